@@ -0,0 +1,19 @@
+; creating and calling closures over mutable state
+(define (make-counter)
+  (let ((count 0))
+    (lambda () (set! count (+ count 1)) count)))
+
+(define (compose f g)
+  (lambda (x) (f (g x))))
+
+(define (add-n n)
+  (lambda (x) (+ x n)))
+
+(define (run n counter)
+  (if (= n 0)
+      (counter)
+      (begin ((compose (add-n n) (add-n 1)) n)
+             (counter)
+             (run (- n 1) counter))))
+
+(run 20000 (make-counter))
@@ -0,0 +1,17 @@
+; non-tail recursion much deeper than python's default recursion limit
+(define (count-up n)
+  (if (= n 0)
+      '()
+      (cons n (count-up (- n 1)))))
+
+(define (sum-list lst)
+  (if (null? lst)
+      0
+      (+ (car lst) (sum-list (cdr lst)))))
+
+(define (repeat n total)
+  (if (= n 0)
+      total
+      (repeat (- n 1) (+ total (sum-list (count-up 2000))))))
+
+(repeat 20 0)
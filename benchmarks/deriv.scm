@@ -0,0 +1,27 @@
+; symbolic differentiation, dominated by list construction and symbol tests
+(define (deriv a)
+  (if (not (pair? a))
+      (if (equal? a 'x) 1 0)
+      (cond ((equal? (car a) '+)
+             (cons '+ (map deriv (cdr a))))
+            ((equal? (car a) '-)
+             (cons '- (map deriv (cdr a))))
+            ((equal? (car a) '*)
+             (list '* a (cons '+ (map deriv-over-self (cdr a)))))
+            ((equal? (car a) '/)
+             (list '-
+                   (list '/ (deriv (car (cdr a))) (car (cdr (cdr a))))
+                   (list '/ (car (cdr a))
+                         (list '* (car (cdr (cdr a))) (car (cdr (cdr a)))
+                               (deriv (car (cdr (cdr a))))))))
+            (else 'error))))
+
+(define (deriv-over-self a)
+  (list '/ (deriv a) a))
+
+(define (deriv-loop n result)
+  (if (= n 0)
+      result
+      (deriv-loop (- n 1) (deriv '(+ (* 3 x x) (* a x x) (* b x) 5)))))
+
+(length (deriv-loop 3000 '()))
@@ -0,0 +1,28 @@
+; in-place list surgery with set-car! and set-cdr!
+(define (iota n)
+  (define (build i acc)
+    (if (= i 0) acc (build (- i 1) (cons i acc))))
+  (build n '()))
+
+(define (reverse! lst)
+  (define (loop lst result)
+    (if (null? lst)
+        result
+        (let ((rest (cdr lst)))
+          (set-cdr! lst result)
+          (loop rest lst))))
+  (loop lst '()))
+
+(define (scale! lst k)
+  (if (null? lst)
+      'done
+      (begin (set-car! lst (* k (car lst)))
+             (scale! (cdr lst) k))))
+
+(define (churn n lst)
+  (if (= n 0)
+      (car lst)
+      (begin (scale! lst 1)
+             (churn (- n 1) (reverse! lst)))))
+
+(churn 100 (iota 1000))
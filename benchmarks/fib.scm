@@ -0,0 +1,7 @@
+; doubly recursive fibonacci, dominated by non-tail calls and arithmetic
+(define (fib n)
+  (if (< n 2)
+      n
+      (+ (fib (- n 1)) (fib (- n 2)))))
+
+(fib 22)
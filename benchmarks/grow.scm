@@ -0,0 +1,13 @@
+; consing onto a list and taking its length at every step, which uses the
+; cached length of the tail it's consed onto
+(define (grow n acc total)
+  (if (= n 0)
+      total
+      (grow (- n 1) (cons n acc) (+ total (length acc)))))
+
+(define (repeat n total)
+  (if (= n 0)
+      total
+      (repeat (- n 1) (+ total (grow 3000 '() 0)))))
+
+(repeat 10 0)
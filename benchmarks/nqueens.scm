@@ -0,0 +1,24 @@
+; count solutions of the eight queens problem by building lists of placements
+(define (queens board-size)
+  (define (ok? row dist placed)
+    (if (null? placed)
+        #t
+        (if (= (car placed) (+ row dist))
+            #f
+            (if (= (car placed) (- row dist))
+                #f
+                (if (= (car placed) row)
+                    #f
+                    (ok? row (+ dist 1) (cdr placed)))))))
+  (define (try row placed k)
+    (if (= k board-size)
+        1
+        (try-rows 1 placed k)))
+  (define (try-rows row placed k)
+    (if (> row board-size)
+        0
+        (+ (if (ok? row 1 placed) (try row (cons row placed) (+ k 1)) 0)
+           (try-rows (+ row 1) placed k))))
+  (try 0 '() 0))
+
+(queens 8)
@@ -0,0 +1,12 @@
+; exact rational arithmetic with growing numerators and denominators
+(define (harmonic n acc)
+  (if (= n 0)
+      acc
+      (harmonic (- n 1) (+ acc (/ 1 n)))))
+
+(define (alternating n acc)
+  (if (= n 0)
+      acc
+      (alternating (- n 1) (- (* acc 3/4) (/ n (+ n 1))))))
+
+(remainder (denominator (+ (harmonic 2500 0) (alternating 1000 1))) 1000003)
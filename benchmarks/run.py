@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+"""Run benchmarks and compare their times with a baseline.
+
+Every benchmark is a scheme file whose last expression is the workload.
+The expressions before it are evaluated once, then the last one is
+evaluated repeatedly through evaluate and timed. Blocks still allocated
+after it and the peak of bytes allocated are measured in one more run under
+tracemalloc so that tracing doesn't affect times. The baseline keeps results
+of each evaluator apart.
+"""
+
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scheme
+import vm
+from scheme_types import tostr
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+def _read_forms(filename):
+    """Read forms of a benchmark, not expanded yet."""
+    with open(filename) as f:
+        forms = [parts for _, parts in scheme._read_all(f.read())]
+    for parts in forms:
+        if isinstance(parts, Exception):
+            raise parts
+    return forms
+
+def _measure_memory(parts):
+    """Evaluate parts once under tracemalloc, returning blocks still allocated and peak bytes."""
+    tracemalloc.start()
+    try:
+        scheme.evaluate(parts)
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    blocks = sum(i.count for i in snapshot.statistics('filename'))
+    return blocks, peak
+
+def run_benchmark(filename, repeat):
+    """Run a benchmark and return its result and measurements."""
+    forms = _read_forms(filename)
+    # expanded in turn, as forms may define macros used by those after them
+    for parts in forms[:-1]:
+        scheme.evaluate(scheme.expand(parts))
+    forms[-1] = scheme.expand(forms[-1])
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = scheme.evaluate(forms[-1])
+        times.append(time.perf_counter() - start)
+    blocks, peak = _measure_memory(forms[-1])
+    return {
+            'result': tostr(result), 'median': statistics.median(times),
+            'min': min(times), 'retained_blocks': blocks, 'peak_bytes': peak,
+    }
+
+def _compare(name, stats, baseline, threshold):
+    """Format the change from the baseline, returning it and whether it's a regression."""
+    base = baseline.get(name)
+    if base is None:
+        return 'new', False
+    if base['result'] != stats['result']:
+        return 'WRONG RESULT (expected {0})'.format(base['result']), True
+    ratio = stats['median'] / base['median']
+    return '{0:+.1%}'.format(ratio - 1), ratio > 1 + threshold
+
+def main():
+    """Parse command line arguments and run benchmarks."""
+    parser = argparse.ArgumentParser(description='Run scheme benchmarks.')
+    parser.add_argument('names', nargs='*', help='benchmarks to run, all by default')
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+            help='times to run each benchmark')
+    parser.add_argument('--vm', action='store_true', help='run with the bytecode compiler')
+    parser.add_argument('--baseline', default=BASELINE, help='baseline to compare with')
+    parser.add_argument('--save', action='store_true', help='save the results as the baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+            help='slowdown of the median reported as a regression')
+    args = parser.parse_args()
+    if args.vm:
+        scheme._compile = vm.compile_code
+    names = args.names or sorted(os.path.splitext(os.path.basename(i))[0]
+            for i in glob.glob(os.path.join(BENCH_DIR, '*.scm')))
+    evaluator = 'vm' if args.vm else 'analyzer'
+    try:
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    except FileNotFoundError:
+        baselines = {}
+    baseline = baselines.setdefault(evaluator, {})
+    results = {}
+    regressed = False
+    print('{0:<12} {1:>9} {2:>9} {3:>15} {4:>10}  {5} of {6}'.format(
+        'benchmark', 'median', 'min', 'retained blocks', 'peak KiB', 'vs baseline', evaluator))
+    for name in names:
+        stats = results[name] = run_benchmark(os.path.join(BENCH_DIR, name+'.scm'), args.repeat)
+        change, bad = _compare(name, stats, baseline, args.threshold)
+        regressed = regressed or bad
+        print('{0:<12} {1:>8.3f}s {2:>8.3f}s {3:>15} {4:>10.1f}  {5}'.format(
+            name, stats['median'], stats['min'], stats['retained_blocks'],
+            stats['peak_bytes']/1024, change))
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+    return 1 if regressed and not args.save else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
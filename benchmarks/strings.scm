@@ -0,0 +1,12 @@
+; string building by repeated appends and number conversion
+(define (build i acc)
+  (if (= i 0)
+      acc
+      (build (- i 1) (string-append acc (number->string i) ","))))
+
+(define (repeat n result)
+  (if (= n 0)
+      result
+      (repeat (- n 1) (build 500 ""))))
+
+(equal? (repeat 100 "") (build 500 ""))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+"""Limits of steps, wall-clock time and memory of evaluations."""
+
+import contextlib
+import contextvars
+import threading
+import time
+import tracemalloc
+
+import scheme_types
+from scheme_types import *
+
+class LimitExceeded(RuntimeError):
+    """Error raised when an evaluation runs past one of its limits."""
+    pass
+
+# steps between checks of time and memory
+_CHECK_INTERVAL = 1024
+
+class Fuel:
+    """Limits of an evaluation, each of them unlimited if None.
+
+    steps counts calls of procedures and primitives, except those of simple
+    primitives like + run inline, and iterations of do loops. memory is
+    bytes allocated by python and not freed yet, traced only while an
+    evaluation limiting it runs.
+    """
+    __slots__ = ('steps', 'seconds', 'memory')
+    def __init__(self, steps=None, seconds=None, memory=None):
+        """Construct limits."""
+        self.steps = steps
+        self.seconds = seconds
+        self.memory = memory
+
+# budget of the evaluation running in the current context, which futures
+# started by it share
+_budget = contextvars.ContextVar('budget', default=None)
+
+# budgets in use, which keep the step hook installed, and budgets tracing
+# memory, which keep tracemalloc started if it wasn't before
+_lock = threading.Lock()
+_open = 0
+_tracers = 0
+_started_tracing = False
+
+def _start_tracing():
+    """Trace memory for a budget, starting tracemalloc for the first one."""
+    global _tracers, _started_tracing
+    with _lock:
+        if not _tracers and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _tracers += 1
+
+def _stop_tracing():
+    """Stop tracing memory for a budget, stopping tracemalloc after the last one."""
+    global _tracers, _started_tracing
+    with _lock:
+        _tracers -= 1
+        if not _tracers and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+class _Budget:
+    """What's left of the limits of a running evaluation.
+
+    It's open while the evaluation and futures started by it run, and
+    steps are spent by the evaluators only while some budget is open.
+    """
+    __slots__ = ('fuel', 'used', 'countdown', 'deadline', 'memory_base', 'users')
+    def __init__(self, fuel):
+        """Start spending fuel."""
+        global _open
+        self.fuel = fuel
+        self.used = 0
+        self.users = 1
+        self.deadline = None if fuel.seconds is None else time.monotonic() + fuel.seconds
+        if fuel.memory is not None:
+            _start_tracing()
+        self.memory_base = tracemalloc.get_traced_memory()[0] if fuel.memory is not None else 0
+        self.countdown = self._interval()
+        with _lock:
+            _open += 1
+            scheme_types.step_hook = step
+    def _interval(self):
+        """Get steps before the next check, so that the step limit is met exactly."""
+        if self.fuel.steps is None:
+            return _CHECK_INTERVAL
+        return max(1, min(_CHECK_INTERVAL, self.fuel.steps - self.used))
+    def check(self):
+        """Count steps since the last check and complain if a limit is exceeded."""
+        fuel = self.fuel
+        self.used += self._interval()
+        if fuel.steps is not None and self.used >= fuel.steps:
+            raise LimitExceeded('evaluation exceeded {0} steps'.format(fuel.steps))
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise LimitExceeded('evaluation exceeded {0} seconds'.format(fuel.seconds))
+        if fuel.memory is not None and \
+                tracemalloc.get_traced_memory()[0] - self.memory_base > fuel.memory:
+            raise LimitExceeded('evaluation exceeded {0} bytes of memory'.format(fuel.memory))
+        self.countdown = self._interval()
+    def acquire(self):
+        """Keep it open for one more user, like a future."""
+        with _lock:
+            self.users += 1
+    def release(self):
+        """Let a user go, closing it after the last one."""
+        global _open
+        with _lock:
+            self.users -= 1
+            if self.users:
+                return
+            _open -= 1
+            if not _open:
+                scheme_types.step_hook = None
+        if self.fuel.memory is not None:
+            _stop_tracing()
+
+def step():
+    """Spend a step of the budget of the current context, if it has one."""
+    budget = _budget.get()
+    if budget is not None:
+        budget.countdown -= 1
+        if budget.countdown <= 0:
+            budget.check()
+
+@contextlib.contextmanager
+def limiting(fuel):
+    """Evaluate within limits of fuel in the current context, raising LimitExceeded past them.
+
+    Steps are spent through scheme_types.step_hook, which is installed
+    only while some budget is open, so evaluation costs nothing more
+    otherwise.
+    """
+    budget = _Budget(fuel)
+    token = _budget.set(budget)
+    try:
+        yield fuel
+    finally:
+        _budget.reset(token)
+        budget.release()
+
+def _nothing():
+    """Release nothing."""
+    pass
+
+def share_budget():
+    """Keep the budget of the current context open for a thread running in a copy of it.
+
+    Return the function to call when the thread is done.
+    """
+    budget = _budget.get()
+    if budget is None:
+        return _nothing
+    budget.acquire()
+    return budget.release
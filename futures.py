@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+"""Futures evaluating expressions in a pool of threads.
+
+Threads overlap waiting for files and other I/O, while evaluation itself
+still takes turns holding the GIL. Variables of the global environment are
+read and set by single dict operations, which are atomic, so futures may
+define and set! them; caches updated in several steps lock themselves.
+Futures run in the context of their caller, so what they print goes to
+the client of a served session calling them, as does its own output.
+"""
+
+import concurrent.futures
+import contextvars
+import threading
+
+import fuel
+from scheme_types import *
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# workers of the pool, python's default if None
+_max_workers = None
+
+class Future:
+    """Result of a thunk called by a thread of the pool."""
+    __slots__ = ('future',)
+    def __init__(self, future):
+        """Wrap a future of concurrent.futures."""
+        self.future = future
+    def __str__(self):
+        """Return string form."""
+        return '#<future {0}>'.format('done' if self.future.done() else 'running')
+
+def _get_executor():
+    """Get the pool of threads, starting it the first time."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(_max_workers,
+                    thread_name_prefix='scheme-future')
+        return _executor
+
+def spawn(thunk, env):
+    """Call thunk in a thread of the pool, returning its future at once.
+
+    It runs in the context of the caller, spending the same fuel if the
+    caller's evaluation is limited.
+    """
+    context = contextvars.copy_context()
+    release = fuel.share_budget()
+    def call():
+        """Call thunk, letting the budget go when done."""
+        try:
+            return apply_procedure(thunk, [], env)
+        finally:
+            release()
+    return Future(_get_executor().submit(context.run, call))
+
+def _require_future(future, name):
+    """Complain if it isn't a future."""
+    require_type(isa(future, Future), 'the parameter of {0} must be a future'.format(name))
+
+def touch(future):
+    """Wait for the future and return its value, or raise its error."""
+    _require_future(future, 'touch')
+    return future.future.result()
+
+def is_done(future):
+    """Judge whether the future has finished."""
+    _require_future(future, 'future-done?')
+    return future.future.done()
+
+def set_future_workers(num):
+    """Set the number of threads running futures, taking effect on new pools."""
+    global _executor, _max_workers
+    require_type(num is False or is_int(num) and num > 0,
+            'the number of workers must be a positive integer or #f')
+    with _executor_lock:
+        _max_workers = num or None
+        if _executor is not None:
+            # futures running still finish
+            _executor.shutdown(wait=False)
+            _executor = None
+    return None
+
+def define_primitives(env):
+    """Define primitives of futures in env."""
+    env.update({
+        'touch':touch, 'future-done?':is_done, 'future?':lambda x: isa(x, Future),
+        'set-future-workers!':set_future_workers,
+    })
+    return env
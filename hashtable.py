@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+"""Hash tables of SRFI-69 backed by python dicts."""
+
+import fractions
+
+from scheme_types import *
+
+class _Identity:
+    """Key of an object compared by identity."""
+    __slots__ = ('obj',)
+    def __init__(self, obj):
+        """Wrap obj."""
+        self.obj = obj
+    def __hash__(self):
+        """Hash by identity."""
+        return id(self.obj)
+    def __eq__(self, key):
+        """Compare by identity."""
+        return isa(key, _Identity) and self.obj is key.obj
+
+def eqv_key(obj):
+    """Get a key of obj which is equal to keys of objects eqv? to it."""
+    if isa(obj, (Symbol, Char, int, float, fractions.Fraction, complex)):
+        # type tells a symbol or a character from a string and #t from 1
+        return type(obj), obj
+    if is_null(obj):
+        return list, None
+    return _Identity(obj)
+
+def equal_key(obj):
+    """Get a key of obj which is equal to keys of objects equal? to it."""
+    if isa(obj, Pair):
+        members = []
+        while isa(obj, Pair):
+            members.append(equal_key(obj.car))
+            obj = obj.cdr
+        return Pair, tuple(members), equal_key(obj)
+    if isa(obj, Vector):
+        return Vector, tuple(map(equal_key, obj.items))
+    if type(obj) is str:
+        return str, obj
+    return eqv_key(obj)
+
+# key functions of equivalences supported
+_KEYS = {is_eqv: eqv_key, is_equal: equal_key}
+
+class HashTable:
+    """Class for hash table.
+
+    Entries are (key, value) indexed by a key of the original key made by the
+    function of the equivalence, so that python's hash and == agree with it.
+    """
+    __slots__ = ('entries', 'key')
+    def __init__(self, key=equal_key):
+        """Construct an empty table with the key function of its equivalence."""
+        self.entries = {}
+        self.key = key
+    def __str__(self):
+        """Return string form."""
+        return '#<hash-table {0}>'.format(len(self.entries))
+
+def _require_table(table, name):
+    """Complain if table isn't a hash table."""
+    require_type(isa(table, HashTable), 'the first parameter of {0} must be a hash table'.format(name))
+
+def make_hash_table(equiv=None, hash_func=None):
+    """Construct a hash table comparing keys by equiv, equal? by default.
+
+    hash_func is accepted as SRFI-69 does, but keys are always hashed
+    consistently with equiv.
+    """
+    if equiv is None:
+        return HashTable()
+    require_type(isa(equiv, Primitive) and equiv.func in _KEYS,
+            'equivalence of hash table must be eq?, eqv? or equal?')
+    return HashTable(_KEYS[equiv.func])
+
+def is_hash_table(table):
+    """Judge whether it's a hash table."""
+    return isa(table, HashTable)
+
+def hash_table_set(table, key, val):
+    """Set value of key in the table."""
+    _require_table(table, 'hash-table-set!')
+    table.entries[table.key(key)] = key, val
+    return None
+
+def hash_table_ref(table, key, *args):
+    """Get value of key in the table, given to success if any, or call thunk if it's missing."""
+    env = args[-1]
+    thunk = args[0] if len(args) > 1 else None
+    success = args[1] if len(args) > 2 else None
+    _require_table(table, 'hash-table-ref')
+    entry = table.entries.get(table.key(key))
+    if entry is None:
+        if thunk is None:
+            raise LookupError('key not found in hash table: '+tostr(key))
+        return apply_procedure(thunk, [], env)
+    if success is None:
+        return entry[1]
+    return apply_procedure(success, [entry[1]], env)
+
+def hash_table_ref_default(table, key, default):
+    """Get value of key in the table, or default if it's missing."""
+    _require_table(table, 'hash-table-ref/default')
+    entry = table.entries.get(table.key(key))
+    return default if entry is None else entry[1]
+
+def hash_table_update(table, key, proc, *args):
+    """Set value of key to proc applied to its value, or to the result of thunk if it's missing."""
+    env = args[-1]
+    _require_table(table, 'hash-table-update!')
+    val = hash_table_ref(table, key, *args)
+    table.entries[table.key(key)] = key, apply_procedure(proc, [val], env)
+    return None
+
+def hash_table_update_default(table, key, proc, default, env):
+    """Set value of key to proc applied to its value, or to default if it's missing."""
+    _require_table(table, 'hash-table-update!/default')
+    index = table.key(key)
+    entry = table.entries.get(index)
+    val = default if entry is None else entry[1]
+    table.entries[index] = key, apply_procedure(proc, [val], env)
+    return None
+
+def hash_table_delete(table, key):
+    """Remove key from the table."""
+    _require_table(table, 'hash-table-delete!')
+    table.entries.pop(table.key(key), None)
+    return None
+
+def hash_table_exists(table, key):
+    """Judge whether key is in the table."""
+    _require_table(table, 'hash-table-exists?')
+    return table.key(key) in table.entries
+
+def hash_table_size(table):
+    """Get the number of entries in the table."""
+    _require_table(table, 'hash-table-size')
+    return len(table.entries)
+
+def hash_table_keys(table):
+    """Get keys in the table as a list."""
+    _require_table(table, 'hash-table-keys')
+    return seq2list([i[0] for i in table.entries.values()])
+
+def hash_table_values(table):
+    """Get values in the table as a list."""
+    _require_table(table, 'hash-table-values')
+    return seq2list([i[1] for i in table.entries.values()])
+
+def hash_table_walk(table, proc, env):
+    """Call proc with every key and value in the table."""
+    _require_table(table, 'hash-table-walk')
+    # proc may change the table
+    for key, val in list(table.entries.values()):
+        apply_procedure(proc, [key, val], env)
+    return None
+
+def hash_table_fold(table, proc, init, env):
+    """Accumulate init by calling proc with every key, value and the result so far."""
+    _require_table(table, 'hash-table-fold')
+    for key, val in list(table.entries.values()):
+        init = apply_procedure(proc, [key, val, init], env)
+    return init
+
+def hash_table2alist(table):
+    """Get entries in the table as an association list."""
+    _require_table(table, 'hash-table->alist')
+    return seq2list([Pair(key, val) for key, val in table.entries.values()])
+
+def alist2hash_table(alist, equiv=None, hash_func=None):
+    """Construct a table from an association list, where earlier keys take precedence."""
+    require_type(is_list(alist), 'the first parameter of alist->hash-table must be a list')
+    table = make_hash_table(equiv, hash_func)
+    for entry in reversed(list2seq(alist)):
+        require_type(isa(entry, Pair), 'members of alist->hash-table must be pairs')
+        table.entries[table.key(entry.car)] = entry.car, entry.cdr
+    return table
+
+def hash_table_copy(table, mutable=True):
+    """Copy the table."""
+    _require_table(table, 'hash-table-copy')
+    result = HashTable(table.key)
+    result.entries = dict(table.entries)
+    return result
+
+def hash_table_clear(table):
+    """Remove all entries in the table."""
+    _require_table(table, 'hash-table-clear!')
+    table.entries.clear()
+    return None
+
+def hash_obj(obj, bound=None):
+    """Hash obj consistently with equal?, below bound if given."""
+    result = hash(equal_key(obj)) & ((1 << 61) - 1)
+    return result if bound is None else result % bound
+
+def define_primitives(env):
+    """Define primitives of hash tables in env."""
+    env.update({
+        'make-hash-table':make_hash_table, 'hash-table?':is_hash_table,
+        'hash-table-ref':Primitive(hash_table_ref, (2, 4), need_env=True),
+        'hash-table-ref/default':hash_table_ref_default, 'hash-table-set!':hash_table_set,
+        'hash-table-update!':Primitive(hash_table_update, (3, 4), need_env=True),
+        'hash-table-update!/default':Primitive(hash_table_update_default, need_env=True),
+        'hash-table-delete!':hash_table_delete, 'hash-table-exists?':hash_table_exists,
+        'hash-table-contains?':hash_table_exists, 'hash-table-size':hash_table_size,
+        'hash-table-keys':hash_table_keys, 'hash-table-values':hash_table_values,
+        'hash-table-walk':Primitive(hash_table_walk, need_env=True),
+        'hash-table-fold':Primitive(hash_table_fold, need_env=True),
+        'hash-table->alist':hash_table2alist, 'alist->hash-table':alist2hash_table,
+        'hash-table-copy':hash_table_copy, 'hash-table-clear!':hash_table_clear,
+        'hash':hash_obj,
+    })
+    return env
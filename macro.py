@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+"""Macros of syntax-rules, rewriting forms before they're expanded."""
+
+from scheme_types import *
+
+class _Matches(list):
+    """Matches of a pattern followed by an ellipsis."""
+    pass
+
+# expansions of uses cached by a table of macros at most
+MAX_EXPANSIONS = 4096
+
+# forms binding names, with the index of their binding list
+_BINDING_FORMS = {'let': 1, 'let*': 1, 'letrec': 1, 'letrec*': 1, 'do': 1, 'nlet': 2}
+
+def _copy(parts):
+    """Copy lists in parts, since expansion changes them in place."""
+    return [_copy(i) for i in parts] if isa(parts, list) else parts
+
+class SyntaxRules:
+    """Transformer of (syntax-rules (literals...) (pattern template)...).
+
+    Names bound by a template, rather than given to the macro, are renamed
+    to fresh symbols in every expansion, so they never capture names in
+    the arguments.
+    """
+    __slots__ = ('ellipsis', 'literals', 'rules')
+    def __init__(self, spec):
+        """Construct from the syntax-rules form."""
+        require(spec, len(spec) >= 2)
+        rest = spec[1:]
+        # (syntax-rules ellipsis (literals...) rules...) of R7RS
+        self.ellipsis = rest.pop(0) if isa(rest[0], Symbol) else Symbol('...')
+        require(spec, rest and isa(rest[0], list), 'syntax-rules needs a list of literals')
+        self.literals = rest[0]
+        require_type(all(isa(i, Symbol) for i in self.literals),
+                'literals of syntax-rules must be symbols')
+        self.rules = []
+        for rule in rest[1:]:
+            require(rule, isa(rule, list) and len(rule) == 2
+                    and isa(rule[0], list) and rule[0], 'ill-formed syntax rule')
+            pattern, template = rule
+            names = self._pattern_names(pattern[1:])
+            binders = [i for i in self._binders(template) if i not in names]
+            self.rules.append((pattern[1:], template, binders))
+    def expand(self, parts):
+        """Rewrite a use of the macro by the first rule matching it."""
+        for pattern, template, binders in self.rules:
+            bindings = {}
+            if self._match(pattern, parts[1:], bindings):
+                renames = {i: gensym(i) for i in binders}
+                return self._instantiate(template, bindings, renames, self.ellipsis)
+        require(parts, False, 'no syntax rule matches')
+    def _is_name(self, symbol):
+        """Judge whether a symbol of a pattern binds what it matches."""
+        return isa(symbol, Symbol) and symbol not in self.literals \
+                and symbol != self.ellipsis and symbol != '_' and symbol != '.'
+    def _pattern_names(self, pattern):
+        """Collect names bound by a pattern."""
+        if isa(pattern, list):
+            return [j for i in pattern for j in self._pattern_names(i)]
+        return [pattern] if self._is_name(pattern) else []
+    def _binders(self, template):
+        """Collect names a template binds with lambda, let and the like."""
+        result = []
+        if not isa(template, list) or not template:
+            return result
+        head = template[0]
+        if head == 'lambda' and len(template) > 1:
+            parms = template[1]
+            result.extend(parms if isa(parms, list) else [parms])
+        elif isa(head, Symbol) and head in _BINDING_FORMS and len(template) > 1:
+            index = _BINDING_FORMS[head]
+            if head == 'let' and isa(template[1], Symbol):
+                # named let
+                index = 2
+            if index == 2:
+                result.append(template[1])
+            if len(template) > index and isa(template[index], list):
+                result.extend(i[0] for i in template[index] if isa(i, list) and i)
+        for i in template:
+            result.extend(self._binders(i))
+        return [i for i in result if self._is_name(i)]
+    def _match(self, pattern, form, bindings):
+        """Match form with pattern, adding what names of the pattern match to bindings."""
+        if isa(pattern, Symbol):
+            if pattern in self.literals:
+                return isa(form, Symbol) and form == pattern
+            if pattern != '_':
+                bindings[pattern] = form
+            return True
+        if not isa(pattern, list):
+            return type(pattern) is type(form) and pattern == form
+        if not isa(form, list):
+            return False
+        tail = None
+        if len(pattern) >= 2 and pattern[-2] == '.':
+            pattern, tail = pattern[:-2], pattern[-1]
+        if self.ellipsis in pattern:
+            i = pattern.index(self.ellipsis) - 1
+            require(pattern, i >= 0, 'ellipsis must follow a pattern')
+            before, repeated, after = pattern[:i], pattern[i], pattern[i+2:]
+            count = len(form) - len(before) - len(after)
+            if count < 0:
+                return False
+            matches = []
+            for member in form[i:i+count]:
+                match = {}
+                if not self._match(repeated, member, match):
+                    return False
+                matches.append(match)
+            for name in self._pattern_names(repeated):
+                bindings[name] = _Matches(i[name] for i in matches)
+            pattern = before + after
+            form = form[:i] + form[i+count:]
+        if len(form) < len(pattern) or tail is None and len(form) > len(pattern):
+            return False
+        if not all(self._match(i, j, bindings) for i, j in zip(pattern, form)):
+            return False
+        return tail is None or self._match(tail, form[len(pattern):], bindings)
+    def _instantiate(self, template, bindings, renames, ellipsis):
+        """Fill a template with what names of the pattern matched."""
+        if isa(template, Symbol):
+            if template in bindings:
+                value = bindings[template]
+                require_type(not isa(value, _Matches),
+                        '{0} must be followed by an ellipsis in the template'.format(template))
+                return _copy(value)
+            return renames.get(template, template)
+        if not isa(template, list):
+            return template
+        if len(template) == 2 and ellipsis is not None and template[0] == ellipsis:
+            # (... template) escapes ellipses in template
+            return self._instantiate(template[1], bindings, renames, None)
+        result = []
+        i = 0
+        while i < len(template):
+            depth = 0
+            while ellipsis is not None and i+depth+1 < len(template) \
+                    and template[i+depth+1] == ellipsis:
+                depth += 1
+            if depth:
+                result.extend(self._repeat(template[i], bindings, renames, depth))
+            else:
+                result.append(self._instantiate(template[i], bindings, renames, ellipsis))
+            i += depth + 1
+        return result
+    def _repeat(self, template, bindings, renames, depth):
+        """Fill a template followed by depth ellipses once for every match."""
+        names = [i for i in set(self._pattern_names(template))
+                if isa(bindings.get(i), _Matches)]
+        require(template, names, 'no pattern variable to repeat before ellipsis')
+        counts = set(len(bindings[i]) for i in names)
+        require(template, len(counts) == 1, 'pattern variables repeated unevenly')
+        result = []
+        for i in range(counts.pop()):
+            inner = dict(bindings)
+            for name in names:
+                inner[name] = bindings[name][i]
+            if depth > 1:
+                result.extend(self._repeat(template, inner, renames, depth-1))
+            else:
+                result.append(self._instantiate(template, inner, renames, self.ellipsis))
+        return result
+
+class MacroTable:
+    """Macros defined in a global environment, over those of an outer one.
+
+    A session of a server defines macros in a table of its own over that
+    of the global environment, so they don't change the forms of others.
+    Expansions of uses are cached by the table until a macro is defined.
+    """
+    __slots__ = ('macros', 'outer', 'expansions')
+    def __init__(self, outer=None):
+        """Construct a table with no macros of its own."""
+        self.macros = {}
+        self.outer = outer
+        self.expansions = {}
+    def get(self, name):
+        """Get the macro called name, or None if it isn't one."""
+        table = self
+        while table is not None:
+            rules = table.macros.get(name)
+            if rules is not None:
+                return rules
+            table = table.outer
+        return None
+    def define(self, name, rules):
+        """Define a macro, forgetting expansions which may have used the old one."""
+        self.macros[name] = rules
+        self.expansions.clear()
+    def update(self, macros):
+        """Define macros of a dict, like those restored from an image."""
+        self.macros.update(macros)
+        self.expansions.clear()
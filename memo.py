@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+"""Memoization of procedures in caches with LRU eviction."""
+
+import collections
+import threading
+
+from scheme_types import *
+from hashtable import equal_key
+
+# entries kept by memoize unless told otherwise
+DEFAULT_MAX_ENTRIES = 1024
+
+class Memoized:
+    """Cache of results of a procedure, keyed by arguments compared by equal?.
+
+    The least recently used entry is evicted when there are more than
+    max_entries of them. Calls raising errors aren't cached. The cache is
+    locked while it's updated, but not while the procedure runs, so calls
+    from several threads may compute the same result.
+    """
+    __slots__ = ('proc', 'max_entries', 'cache', 'hits', 'misses', 'lock')
+    def __init__(self, proc, max_entries):
+        """Cache results of proc."""
+        self.proc = proc
+        self.max_entries = max_entries
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    def __getstate__(self):
+        """Get state to pickle without the lock."""
+        return self.proc, self.max_entries, self.cache, self.hits, self.misses
+    def __setstate__(self, state):
+        """Restore pickled state with a new lock."""
+        self.proc, self.max_entries, self.cache, self.hits, self.misses = state
+        self.lock = threading.Lock()
+    def __call__(self, *args):
+        """Call the procedure with args unless its result is cached."""
+        env = args[-1]
+        args = args[:-1]
+        key = tuple(map(equal_key, args))
+        cache = self.cache
+        with self.lock:
+            if key in cache:
+                self.hits += 1
+                cache.move_to_end(key)
+                return cache[key]
+            self.misses += 1
+        result = apply_procedure(self.proc, list(args), env)
+        with self.lock:
+            cache[key] = result
+            if len(cache) > self.max_entries:
+                cache.popitem(last=False)
+        return result
+
+def memoize(proc, max_entries=DEFAULT_MAX_ENTRIES):
+    """Wrap proc in a procedure caching its results."""
+    require_type(is_procedure(proc), 'the first parameter of memoize must be a procedure')
+    require_type(is_int(max_entries) and max_entries > 0,
+            'the number of entries of memoize must be a positive integer')
+    result = Primitive(Memoized(proc, max_entries), (0, None), need_env=True)
+    result.name = 'memoized'
+    return result
+
+def _memoized(proc, name):
+    """Get the cache of a procedure made by memoize."""
+    require_type(isa(proc, Primitive) and isa(proc.func, Memoized),
+            'the parameter of {0} must be a memoized procedure'.format(name))
+    return proc.func
+
+def memoize_stats(proc):
+    """Get hits, misses, size and max entries of the cache as an association list."""
+    memo = _memoized(proc, 'memoize-stats')
+    return seq2list([Pair(Symbol('hits'), memo.hits), Pair(Symbol('misses'), memo.misses),
+        Pair(Symbol('size'), len(memo.cache)), Pair(Symbol('max-entries'), memo.max_entries)])
+
+def memoize_clear(proc):
+    """Remove all entries and statistics of the cache."""
+    memo = _memoized(proc, 'memoize-clear!')
+    with memo.lock:
+        memo.cache.clear()
+        memo.hits = memo.misses = 0
+    return None
+
+def define_primitives(env):
+    """Define primitives of memoization in env."""
+    env.update({
+        'memoize':memoize, 'memoized?':lambda x: isa(x, Primitive) and isa(x.func, Memoized),
+        'memoize-stats':memoize_stats, 'memoize-clear!':memoize_clear,
+    })
+    return env
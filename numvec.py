@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+"""SRFI-4 numeric vectors backed by NumPy arrays, defined only if NumPy is installed.
+
+NumPy is imported when a primitive first needs it, so that starting the
+interpreter doesn't pay for it.
+"""
+
+import importlib.util
+import math
+import operator as op
+
+numpy = None
+
+from scheme_types import *
+
+def _numpy():
+    """Get NumPy, importing it the first time."""
+    global numpy
+    if numpy is None:
+        import numpy
+    return numpy
+
+class NumVector:
+    """Class for f64vector and s64vector, holding a NumPy array of float64 or int64.
+
+    Bulk operations run as one NumPy call. Arithmetic of s64vectors wraps
+    around on overflow like NumPy's. Maps keep the type of their vectors,
+    while elementwise operations return f64vectors when their result is
+    floating, as numvector-div always is.
+    """
+    __slots__ = ('array',)
+    def __init__(self, array):
+        """Wrap a NumPy array."""
+        self.array = array
+    @property
+    def tag(self):
+        """Return f64 or s64."""
+        return 'f64' if self.array.dtype.kind == 'f' else 's64'
+    def __str__(self):
+        """Return string form."""
+        return '#{0}({1})'.format(self.tag, ' '.join(map(tostr, self.array.tolist())))
+    def __len__(self):
+        """Get length of the vector."""
+        return len(self.array)
+    def __eq__(self, vector):
+        """Compare two vectors."""
+        return isa(vector, NumVector) and self.array.dtype == vector.array.dtype \
+                and bool(_numpy().array_equal(self.array, vector.array))
+
+_DTYPES = {'f64': 'float64', 's64': 'int64'}
+
+def _wrap(array):
+    """Wrap a result of NumPy as a vector of float64 or int64."""
+    if array.dtype.kind == 'f':
+        return NumVector(array.astype('float64', copy=False))
+    if array.dtype.kind in 'iub':
+        return NumVector(array.astype('int64', copy=False))
+    raise TypeError('result of numeric vector operation must be real numbers')
+
+def _scalar(value):
+    """Convert a scalar of NumPy into a python number."""
+    return value.item() if isa(value, _numpy().generic) else value
+
+def _require_vector(vector, name, tag=None):
+    """Complain if vector isn't a numeric vector of tag."""
+    require_type(isa(vector, NumVector) and (tag is None or vector.tag == tag),
+            'parameters of {0} must be {1}vectors'.format(name, tag or 'numeric '))
+
+def _check_element(tag, val):
+    """Complain if val can't be stored in a vector of tag."""
+    # booleans are ints of python, but not numbers of scheme
+    if tag == 's64':
+        require_type(is_int(val) and not isa(val, bool) and -(1<<63) <= val < 1<<63,
+                'members of s64vector must be 64-bit integers')
+    else:
+        require_type(is_rational(val) and not isa(val, bool),
+                'members of f64vector must be real numbers')
+
+def _operand(value, name):
+    """Get array of a vector or a number for elementwise operations."""
+    if isa(value, NumVector):
+        return value.array
+    require_type(is_rational(value) and not isa(value, bool),
+            'parameters of {0} must be numeric vectors or numbers'.format(name))
+    # NumPy keeps exact fractions as objects
+    return value if isa(value, (int, float)) else float(value)
+
+def _define_type(tag, env):
+    """Define primitives of vectors of tag."""
+    dtype = _DTYPES[tag]
+    name = tag + 'vector'
+    def make(num, fill=0):
+        """Construct a vector filled with num numbers of value fill."""
+        require_type(is_int(num) and num >= 0, 'length of {0} must be a natural number'.format(name))
+        _check_element(tag, fill)
+        return NumVector(_numpy().full(num, fill, dtype=dtype))
+    def construct(*members):
+        """Construct a vector with members."""
+        for i in members:
+            _check_element(tag, i)
+        return NumVector(_numpy().array(members, dtype=dtype))
+    def ref(vector, i):
+        """Return the ith element of the vector."""
+        _require_vector(vector, name+'-ref', tag)
+        if not is_int(i) or i < 0 or i >= len(vector.array):
+            raise IndexError('{0} index out of range'.format(name))
+        return vector.array[i].item()
+    def set_(vector, i, val):
+        """Set value in vector by index."""
+        _require_vector(vector, name+'-set!', tag)
+        if not is_int(i) or i < 0 or i >= len(vector.array):
+            raise IndexError('{0} index out of range'.format(name))
+        _check_element(tag, val)
+        vector.array[i] = val
+        return None
+    def length(vector):
+        """Get length of the vector."""
+        _require_vector(vector, name+'-length', tag)
+        return len(vector.array)
+    def to_list(vector):
+        """Convert the vector into a scheme list."""
+        _require_vector(vector, name+'->list', tag)
+        return seq2list(vector.array.tolist())
+    def from_list(s_list):
+        """Convert a scheme list into a vector."""
+        require_type(is_list(s_list), 'parameters of list->{0} must be a list'.format(name))
+        return construct(*(s_list or ()))
+    def map_(*args):
+        """Map procedure over vectors, in one call of NumPy if it's a primitive."""
+        args = list(args)
+        env = args.pop()
+        require(args, len(args)>1)
+        proc = args.pop(0)
+        require_type(is_procedure(proc),
+                'the first parameter of {0}-map must be a procedure'.format(name))
+        for vector in args:
+            _require_vector(vector, name+'-map', tag)
+        ufunc = _ufunc(proc, len(args))
+        if ufunc is not None:
+            with _numpy().errstate(divide='raise', invalid='raise'):
+                try:
+                    result = ufunc(*[i.array for i in args])
+                except FloatingPointError:
+                    result = None
+            # otherwise the primitive decides, like sqrt of a negative number
+            # or / of integers not dividing evenly
+            if result is not None and result.dtype == dtype:
+                return NumVector(result)
+        result = [apply_procedure(proc, list(members), env)
+                for members in zip(*[i.array.tolist() for i in args])]
+        for i in result:
+            _check_element(tag, i)
+        return NumVector(_numpy().array(result, dtype=dtype))
+    env.update({
+        name+'?': lambda x: isa(x, NumVector) and x.tag == tag, 'make-'+name: make,
+        name: construct, name+'-ref': ref, name+'-set!': set_, name+'-length': length,
+        name+'->list': to_list, 'list->'+name: from_list,
+        name+'-map': Primitive(map_, need_env=True),
+    })
+
+# ufuncs used by map for primitives taking one or two arguments
+_UNARY = [(sub, 'negative'), (op.neg, 'negative'), (abs, 'absolute'),
+        (do_sqrt, 'sqrt'), (math.sin, 'sin'), (math.cos, 'cos'), (math.tan, 'tan'),
+        (math.asin, 'arcsin'), (math.acos, 'arccos'), (math.atan, 'arctan'),
+        (math.floor, 'floor'), (math.ceil, 'ceil'), (math.trunc, 'trunc')]
+_BINARY = [(add, 'add'), (op.add, 'add'), (sub, 'subtract'), (op.sub, 'subtract'),
+        (mul, 'multiply'), (op.mul, 'multiply'), (div, 'true_divide'),
+        (op.truediv, 'true_divide'), (max, 'maximum'), (min, 'minimum')]
+
+def _ufunc(proc, nargs):
+    """Get the ufunc doing what a primitive does, or None."""
+    if not isa(proc, Primitive) or nargs > 2:
+        return None
+    for func, name in _UNARY if nargs == 1 else _BINARY:
+        if proc.func is func:
+            return getattr(_numpy(), name)
+    return None
+
+def _elementwise(name, ufunc):
+    """Make an elementwise operation on vectors and numbers, with the ufunc of NumPy named ufunc."""
+    def operate(left, right):
+        """Operate on members of vectors, or with a number."""
+        require_type(isa(left, NumVector) or isa(right, NumVector),
+                'parameters of {0} must be numeric vectors or numbers'.format(name))
+        return _wrap(getattr(_numpy(), ufunc)(_operand(left, name), _operand(right, name)))
+    return operate
+
+def _reduction(name, func):
+    """Make a reduction of a vector into a number, with the function of NumPy named func."""
+    def reduce(vector):
+        """Reduce members of the vector."""
+        _require_vector(vector, name)
+        require_type(len(vector.array) or name == 'numvector-sum',
+                'parameter of {0} must not be empty'.format(name))
+        return _scalar(getattr(_numpy(), func)(vector.array))
+    return reduce
+
+def dot(left, right):
+    """Compute dot product of two vectors."""
+    _require_vector(left, 'numvector-dot')
+    _require_vector(right, 'numvector-dot')
+    require_type(len(left.array) == len(right.array),
+            'parameters of numvector-dot must have the same length')
+    return _scalar(_numpy().dot(left.array, right.array))
+
+def slice_(vector, beg, end):
+    """Copy members of the vector from beg to end."""
+    _require_vector(vector, 'numvector-slice')
+    if not (is_int(beg) and is_int(end) and 0 <= beg <= end <= len(vector.array)):
+        raise IndexError('the index of numvector-slice is invalid')
+    return NumVector(vector.array[beg:end].copy())
+
+def define_primitives(env):
+    """Define primitives of numeric vectors in env if NumPy is installed."""
+    if importlib.util.find_spec('numpy') is None:
+        return env
+    for tag in _DTYPES:
+        _define_type(tag, env)
+    env.update({
+        'numvector-add': _elementwise('numvector-add', 'add'),
+        'numvector-sub': _elementwise('numvector-sub', 'subtract'),
+        'numvector-mul': _elementwise('numvector-mul', 'multiply'),
+        'numvector-div': _elementwise('numvector-div', 'true_divide'),
+        'numvector-sum': _reduction('numvector-sum', 'sum'),
+        'numvector-min': _reduction('numvector-min', 'min'),
+        'numvector-max': _reduction('numvector-max', 'max'),
+        'numvector-mean': _reduction('numvector-mean', 'mean'),
+        'numvector-dot': dot, 'numvector-slice': slice_,
+    })
+    return env
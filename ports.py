@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+"""Input and output ports of files, strings and the console."""
+
+import contextlib
+import contextvars
+import io
+import sys
+
+from tokenizer import Tokenizer
+from scheme_types import *
+
+EOF = Symbol('#!eof')
+
+# size of buffers of files written
+_BUFFER_SIZE = 1 << 16
+
+class InputPort:
+    """Port reading characters and datums from a text stream.
+
+    Both are read through one Tokenizer, so its buffer is shared by them.
+    """
+    __slots__ = ('file', 'tokenizer', 'closed')
+    def __init__(self, file):
+        """Read from file."""
+        self.file = file
+        self.tokenizer = Tokenizer(file)
+        self.closed = False
+    def __str__(self):
+        """Return string form."""
+        return '#<input-port>'
+
+class OutputPort:
+    """Port writing text to a buffered stream, or to sys.stdout if it's None."""
+    __slots__ = ('file', 'closed')
+    def __init__(self, file=None):
+        """Write to file."""
+        self.file = file
+        self.closed = False
+    def __str__(self):
+        """Return string form."""
+        return '#<output-port>'
+    @property
+    def stream(self):
+        """Get the stream written."""
+        return sys.stdout if self.file is None else self.file
+    def write(self, text):
+        """Write text."""
+        self.stream.write(text)
+
+console_input = InputPort(sys.stdin)
+console_output = OutputPort()
+
+# input port of the console, which a session of a server reads from its client
+_current_input = contextvars.ContextVar('current_input', default=console_input)
+
+def current_input():
+    """Get the input port of the console in the current context."""
+    return _current_input.get()
+
+@contextlib.contextmanager
+def reading_console(file):
+    """Make the console read from file in the current context, like lines of a client."""
+    token = _current_input.set(InputPort(file))
+    try:
+        yield
+    finally:
+        _current_input.reset(token)
+
+def _input(port, name):
+    """Get an open input port, the console by default."""
+    if port is None:
+        return _current_input.get()
+    require_type(isa(port, InputPort), 'the parameter of {0} must be an input port'.format(name))
+    require_type(not port.closed, 'the port of {0} is closed'.format(name))
+    return port
+
+def _output(port, name):
+    """Get an open output port, or None for the console."""
+    if port is None or port is console_output:
+        return None
+    require_type(isa(port, OutputPort), 'the parameter of {0} must be an output port'.format(name))
+    require_type(not port.closed, 'the port of {0} is closed'.format(name))
+    return port
+
+def is_port(port):
+    """Judge whether it's a port."""
+    return isa(port, (InputPort, OutputPort))
+
+def is_input(port):
+    """Judge whether the port is an input port."""
+    return isa(port, InputPort)
+
+def is_output(port):
+    """Judge whether the port is an output port."""
+    return isa(port, OutputPort)
+
+def open_input_file(filename):
+    """Open a file to read."""
+    return InputPort(open(filename))
+
+def open_output_file(filename):
+    """Open a file to write."""
+    return OutputPort(open(filename, 'w', buffering=_BUFFER_SIZE))
+
+def open_input_string(string):
+    """Open a port reading a string."""
+    require_type(isa(string, str), 'the parameter of open-input-string must be a string')
+    return InputPort(io.StringIO(string))
+
+def open_output_string():
+    """Open a port collecting text written to it."""
+    return OutputPort(io.StringIO())
+
+def get_output_string(port):
+    """Get text written to a port opened by open-output-string."""
+    require_type(isa(port, OutputPort) and isa(port.file, io.StringIO),
+            'the parameter of get-output-string must be a string port')
+    return port.file.getvalue()
+
+def call_with_output_string(proc, env):
+    """Call proc with a string port and return text written to it."""
+    port = open_output_string()
+    apply_procedure(proc, [port], env)
+    return port.file.getvalue()
+
+def read(port=None):
+    """Read a datum from the port."""
+    tokenizer = _input(port, 'read').tokenizer
+    parts = read_parts(tokenizer)
+    while parts == ')':
+        parts = read_parts(tokenizer)
+    return EOF if parts is None else do_quote(parts)
+
+def read_char(port=None):
+    """Read a character from the port."""
+    char = _input(port, 'read-char').tokenizer.read_char()
+    return EOF if char is None else Char(char)
+
+def peek_char(port=None):
+    """Get the next character of the port without reading it."""
+    char = _input(port, 'peek-char').tokenizer.peek_char()
+    return EOF if char is None else Char(char)
+
+def read_line(port=None):
+    """Read a line from the port."""
+    line = _input(port, 'read-line').tokenizer.read_line()
+    return EOF if line is None else line
+
+def display(content, port=None):
+    """Print content on a line, or write it to the port as it is."""
+    text = content if isa(content, str) else tostr(content)
+    port = _output(port, 'display')
+    if port is None:
+        print(text)
+    else:
+        port.write(text)
+
+def write(content, port=None):
+    """Print content in the form read back, on a line unless written to a port."""
+    port = _output(port, 'write')
+    if port is None:
+        print(tostr(content))
+    else:
+        port.write(tostr(content))
+
+def newline(port=None):
+    """Write a newline."""
+    (_output(port, 'newline') or console_output).write('\n')
+
+def write_char(char, port=None):
+    """Write a character."""
+    require_type(isa(char, Char), 'the first parameter of write-char must be a character')
+    (_output(port, 'write-char') or console_output).write(char)
+
+def write_string(string, port=None):
+    """Write a string."""
+    require_type(isa(string, str), 'the first parameter of write-string must be a string')
+    (_output(port, 'write-string') or console_output).write(string)
+
+def flush_output(port=None):
+    """Write text buffered by the port."""
+    (_output(port, 'flush-output-port') or console_output).stream.flush()
+
+def close_port(port):
+    """Close the port, except the console."""
+    require_type(is_port(port), 'the parameter must be a port')
+    if port is not _current_input.get() and port is not console_input \
+            and port is not console_output:
+        port.file.close()
+        port.closed = True
+
+def close_input(port):
+    """Close input port."""
+    require_type(is_input(port), 'the parameter must be an input port')
+    close_port(port)
+
+def close_output(port):
+    """Close the output port."""
+    require_type(is_output(port), 'the parameter must be an output port')
+    close_port(port)
+
+def define_primitives(env):
+    """Define primitives of ports in env."""
+    env.update({
+        'port?':is_port, 'input-port?':is_input, 'output-port?':is_output,
+        'current-input-port':current_input,
+        'current-output-port':lambda: console_output,
+        'open-input-file':open_input_file, 'open-output-file':open_output_file,
+        'open-input-string':open_input_string, 'open-output-string':open_output_string,
+        'get-output-string':get_output_string,
+        'call-with-output-string':Primitive(call_with_output_string, need_env=True),
+        'read':read, 'read-char':read_char, 'peek-char':peek_char, 'read-line':read_line,
+        'eof-object':lambda: EOF, 'eof-object?':is_eof, 'display':display,
+        'write':write, 'newline':newline, 'write-char':write_char,
+        'write-string':write_string, 'flush-output-port':flush_output,
+        'close-port':close_port, 'close-input-port':close_input,
+        'close-output-port':close_output, 'char?':lambda x: isa(x, Char),
+    })
+    return env
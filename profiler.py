@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""Profiler counting calls and time of procedures and primitives."""
+
+import sys
+import time
+
+import scheme_types
+from scheme_types import *
+
+class _Stats:
+    """Measurements of a procedure or primitive."""
+    __slots__ = ('name', 'calls', 'tail_calls', 'self_time', 'cum_time', 'active')
+    def __init__(self, name):
+        """Start with nothing measured."""
+        self.name = name
+        self.calls = 0
+        self.tail_calls = 0
+        self.self_time = 0.0
+        self.cum_time = 0.0
+        # calls not returned yet, so that recursion isn't counted twice in cum_time
+        self.active = 0
+
+class Profiler:
+    """Replacement of apply_procedure and call_primitive which measures calls.
+
+    Procedures are told apart by the lambda creating them and named after
+    their define site. The evaluators call the profiler's methods only while
+    it's installed by scheme.profiling, so they cost nothing otherwise.
+    Calls still spend fuel of limited evaluations, as apply_procedure's do.
+    """
+    def __init__(self):
+        """Construct a profiler with nothing measured."""
+        self.stats = {}
+        # [stats, start, time of children] of calls running
+        self._stack = []
+    def _stats(self, key, name):
+        """Get measurements of key."""
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = _Stats(name)
+        return stats
+    def _enter(self, stats):
+        """Start timing a call."""
+        stats.calls += 1
+        stats.active += 1
+        self._stack.append([stats, time.perf_counter(), 0.0])
+    def _leave(self):
+        """Stop timing the latest call."""
+        stats, start, children = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        stats.self_time += elapsed - children
+        stats.active -= 1
+        if not stats.active:
+            stats.cum_time += elapsed
+        if self._stack:
+            self._stack[-1][2] += elapsed
+    def apply_procedure(self, func, args, env):
+        """Apply func to args like apply_procedure, measuring every call."""
+        tail = False
+        while True:
+            if not isa(func, Procedure):
+                return self.call_primitive(func, args, env)
+            if scheme_types.step_hook is not None:
+                scheme_types.step_hook()
+            scope = func.scope
+            stats = self._stats(scope, scope.name or 'lambda')
+            if tail:
+                stats.tail_calls += 1
+            if scope.arity != len(args):
+                args = func.collect_args(args)
+            if scope.padding:
+                args.extend(scope.padding)
+            self._enter(stats)
+            try:
+                result = func.body(Frame(args, func.env, scope))
+            finally:
+                self._leave()
+            if type(result) is not TailCall:
+                return result
+            func, args = result.func, result.args
+            tail = True
+    def call_primitive(self, func, args, env):
+        """Call a primitive like call_primitive, measuring the call."""
+        self._enter(self._stats(func, getattr(func, 'name', str(func))))
+        try:
+            return call_primitive(func, args, env)
+        finally:
+            self._leave()
+    def report(self, out=sys.stderr, limit=None):
+        """Print measurements sorted by self time."""
+        rows = sorted(self.stats.values(), key=lambda i: i.self_time, reverse=True)
+        out.write('{0:>10} {1:>10} {2:>10} {3:>10}  {4}\n'.format(
+            'calls', 'tail', 'self(s)', 'cum(s)', 'name'))
+        for i in rows[:limit]:
+            out.write('{0:>10} {1:>10} {2:>10.4f} {3:>10.4f}  {4}\n'.format(
+                i.calls, i.tail_calls, i.self_time, i.cum_time, i.name))
+        out.flush()
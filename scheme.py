@@ -1,15 +1,39 @@
 #!/usr/bin/env python3
 
+import argparse
+import contextlib
+import contextvars
+import hashlib
+import io
+import multiprocessing
 import operator as op
+import os
+import pickle
+import threading
 
 from tokenizer import Tokenizer
+from fuel import Fuel, LimitExceeded, limiting
+import scheme_types
 from scheme_types import *
+import vm
+import profiler
+import numvec
+import hashtable
+import ports
+import memo
+import streams
+import macro
+import futures
 
 def s_eval(content, env):
     """Procedure eval of scheme."""
-    if isa(content, List):
-        content = content.members
-    return evaluate(_expand(content,True), env)
+    return evaluate(expand(_list2code(content), env), env)
+
+def _list2code(content):
+    """Convert scheme lists in data into python lists to be evaluated."""
+    if isa(content, Pair):
+        return [_list2code(i) for i in list2seq(content)]
+    return content
 
 def s_map(*args):
     """Map in scheme."""
@@ -18,52 +42,190 @@ def s_map(*args):
     require(args, len(args)>1)
     require_type(is_procedure(args[0]),
             'the first parameter of map must be a procedure')
-    min_len = sys.maxsize
     proc = args.pop(0)
     for s_list in args:
-        require_type(isa(s_list, List), 'parameters of map must be lists')
-        if len(s_list) < min_len:
-            min_len = len(s_list)
+        require_type(is_list(s_list), 'parameters of map must be lists')
     result = []
-    for i in range(min_len):
-        subexpr = [proc]
-        for arg in args:
-            subexpr.append(arg[i])
-        result.append(evaluate(subexpr,env))
-    return List(result)
+    for members in zip(*[s_list or () for s_list in args]):
+        result.append(apply_procedure(proc, list(members), env))
+    return seq2list(result)
+
+def _parallel_args(name, args):
+    """Check arguments of parallel-map or parallel-for-each, returning the procedure and tuples of members."""
+    require(args, len(args)>1)
+    require_type(is_procedure(args[0]),
+            'the first parameter of {0} must be a procedure'.format(name))
+    for s_list in args[1:]:
+        require_type(is_list(s_list), 'parameters of {0} must be lists'.format(name))
+    return args[0], list(zip(*[s_list or () for s_list in args[1:]]))
+
+def s_parallel_map(*args):
+    """Map in worker processes, keeping the order of results."""
+    proc, members = _parallel_args('parallel-map', args[:-1])
+    return seq2list(_parallel_apply(proc, members))
+
+def s_parallel_for_each(*args):
+    """Call procedure with members of lists in worker processes."""
+    proc, members = _parallel_args('parallel-for-each', args[:-1])
+    _parallel_apply(proc, members)
+    return None
+
+def set_parallel_workers(num):
+    """Set the number of worker processes, or use all cores if it's #f."""
+    global _parallel_workers
+    require_type(num is False or is_int(num) and num > 0,
+            'the number of workers must be a positive integer or #f')
+    _parallel_workers = num or None
+    return None
+
+def set_parallel_chunk_size(num):
+    """Set the number of calls sent to a worker at once, or choose it by the work if it's #f."""
+    global _parallel_chunk_size
+    require_type(num is False or is_int(num) and num > 0,
+            'the chunk size must be a positive integer or #f')
+    _parallel_chunk_size = num or None
+    return None
+
+def _vector_args(name, args):
+    """Check arguments of vector-map or vector-for-each, returning the procedure."""
+    require(args, len(args)>1)
+    require_type(is_procedure(args[0]),
+            'the first parameter of {0} must be a procedure'.format(name))
+    for vector in args[1:]:
+        require_type(isa(vector, Vector), 'parameters of {0} must be vectors'.format(name))
+    return args.pop(0)
+
+def s_vector_map(*args):
+    """Vector-map in scheme."""
+    args = list(args)
+    env = args.pop()
+    proc = _vector_args('vector-map', args)
+    return Vector([apply_procedure(proc, list(members), env)
+            for members in zip(*[i.items for i in args])])
+
+def s_vector_for_each(*args):
+    """Vector-for-each in scheme."""
+    args = list(args)
+    env = args.pop()
+    proc = _vector_args('vector-for-each', args)
+    for members in zip(*[i.items for i in args]):
+        apply_procedure(proc, list(members), env)
+    return None
 
 def s_apply(*args):
     """Apply in scheme."""
     args = list(args)
     env = args.pop()
-    require(args, len(args)>1)
-    require_type(isa(args[-1], List), 'the last parameter of apply must be a list')
-    require_type(is_procedure(args[0]),
-            'the first parameter of apply must be a procedure')
-    end_list = args.pop()
-    args += end_list.members
-    return evaluate(args, env)
+    proc, args = spread_args(args)
+    return apply_procedure(proc, args, env)
+
+# bump it when the layout of forms read changes
+_CACHE_VERSION = 7
+_CACHE_DIR = '__schemecache__'
+
+def s_load(filename, env):
+    """Load in scheme, defining in the global environment of the caller."""
+    if isa(env, Frame):
+        env = root_env(env.scope)
+    return load_file(filename, env)
+
+def load_file(filename, env=None):
+    """Load file to evaluate, reusing its forms read and cached for the same source.
+
+    Every form is expanded right before it's evaluated, so macros defined
+    by forms before it, even in files they load, are used.
+    """
+    if env is None:
+        env = global_env
+    with open(filename, 'rb') as f:
+        source = f.read()
+    for _, parts in _load_cache(filename, source):
+        if isa(parts, Exception):
+            # syntax errors are reported where they are met
+            _print_error(parts)
+            continue
+        try:
+            print(tostr(evaluate(expand(parts, env), env)))
+        except Exception as e:
+            _print_error(e)
+
+def _cache_path(filename):
+    """Get the path of the cache of forms read from a file."""
+    directory, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(directory, _CACHE_DIR, name + '.pickle')
+
+def _load_cache(filename, source):
+    """Get forms read from source, not expanded yet, from the cache, or read and cache them."""
+    key = (_CACHE_VERSION, sys.implementation.cache_tag, __name__,
+            hashlib.sha256(source).hexdigest())
+    path = _cache_path(filename)
+    try:
+        with open(path, 'rb') as f:
+            cached_key, forms = pickle.load(f)
+        if cached_key == key:
+            return forms
+    except Exception:
+        # missing, stale or unreadable
+        pass
+    forms = _read_all(source.decode('utf-8'))
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # unique to the thread, as futures may load the file at once
+        tmp = '{0}.{1}.{2}'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as f:
+            pickle.dump((key, forms), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except (OSError, pickle.PicklingError):
+        pass
+    return forms
 
-def load_file(filename):
-    """Load file to evaluate."""
-    repl(open(filename))
+def _read_all(text):
+    """Read all statements in text into (line, parts), with errors in place of bad ones."""
+    return list(_read_forms(Tokenizer(io.StringIO(text))))
+
+def _read_forms(tokenizer):
+    """Yield (line, parts) of statements read, keeping errors in place of bad ones as repl does.
+
+    They are not expanded, as macros defined by statements before may be used.
+    """
+    line = None
+    while True:
+        try:
+            line = tokenizer.next_line()
+            parts = read_parts(tokenizer)
+        except Exception as e:
+            yield line, e
+            continue
+        if parts is None:
+            return
+        if parts != ')':
+            yield line, parts
 
 def _init_global_env(env):
     """Initialize the global environment."""
     import math
     env.update({
-        '+':op.add, '-':op.sub, '*':op.mul, '/':op.truediv, 'not':not_op,
-        '>':op.gt, '<':op.lt, '>=':op.ge, '<=':op.le, '=':do_is, 'length':len,
-        'cons':cons, 'set-car!':set_car, 'set-cdr!':set_cdr, 'gcd':fractions.gcd,
+        '+':Primitive(add, fast2=op.add), '-':Primitive(sub, (1, None), fast2=op.sub),
+        '*':Primitive(mul, fast2=op.mul), '/':Primitive(div, (1, None), fast2=div2),
+        '>':Primitive(chain_cmp(op.gt), fast2=op.gt), 'not':not_op,
+        '<':Primitive(chain_cmp(op.lt), fast2=op.lt), 'length':len,
+        '>=':Primitive(chain_cmp(op.ge), fast2=op.ge),
+        '<=':Primitive(chain_cmp(op.le), fast2=op.le),
+        '=':Primitive(chain_cmp(op.eq), fast2=op.eq),
+        'cons':cons, 'set-car!':set_car, 'set-cdr!':set_cdr,
+        'gcd':Primitive(gcd, check=is_int, msg='parameters of gcd must be integers'),
+        'lcm':Primitive(lcm_all, check=is_int, msg='parameters of lcm must be integers'),
         'car':lambda x: x.car, 'cdr':get_cdr, 'rational?':is_rational,
-        'boolean?':lambda x: isa(x,bool), 'integer?':is_int, 'lcm':lcm,
+        'boolean?':lambda x: isa(x,bool), 'integer?':is_int,
         'real?':is_rational,    # it seems in scheme rational? equals real?
-        'number?':is_number, 'null?':lambda x: x==[], 'equal?':op.eq,
-        'string?':lambda x: isa(x,str) and not is_eof(x), 'expt':math.pow,
-        'max': max, 'min':min, 'abs':abs, 'list':List, 'list-ref':list_ref,
+        'number?':is_number, 'null?':lambda x: x==[], 'equal?':is_equal,
+        'string?':lambda x: type(x) is str, 'expt':expt,
+        'max': max, 'min':min, 'abs':abs, 'list':lambda *x: seq2list(x), 'list-ref':list_ref,
         'number->string':num2str,'string->number':str2num, 'make-list':make_list,
-        'pair?':is_pair, 'list?':is_list, 'append':append, 'display':display,
-        'quotient':quotient, 'remainder':remainder, 'modulo':op.mod,
+        'pair?':is_pair, 'list?':is_list, 'append':append,
+        'quotient':Primitive(quotient, check=is_int, msg=_MOD_MSG),
+        'remainder':Primitive(remainder, check=is_int, msg=_MOD_MSG),
+        'modulo':Primitive(op.mod, (2, 2), check=is_int, msg=_MOD_MSG),
         'sqrt':do_sqrt, 'numerator':numerator, 'denominator':denominator,
         'floor':math.floor, 'ceiling':math.ceil, 'truncate':math.trunc,
         'round':round, 'zero?':lambda x: x==0, 'negative?':lambda x: x<0,
@@ -74,19 +236,74 @@ def _init_global_env(env):
         'magnitude':lambda x: math.sqrt(x.real*x.real+x.imag*x.imag),
         'complex?':is_complex, 'string->symbol':str2symbol, 'substring':substr,
         'string-append':append_str, 'symbol?':lambda x:isa(x,Symbol),
-        'reverse':reverse_list, 'procedure?':is_procedure, 'load':load_file,
-        'eval':s_eval, 'odd?':lambda x: x%2!=0, 'apply':s_apply, 'map':s_map,
-        'open-input-file':open, 'port?':lambda x: isa(x,type(sys.stdout)),
-        'input-port?':is_input, 'read':read, 'list-set!':list_set, 'true': True,
-        'eof-object?':is_eof, 'close-input-port':close_input, 'and':s_and,
-        'open-output-file':lambda x: open(x,'w'), 'output-port?':is_output,
-        'write':write, 'close-output-port':close_output, 'false':False,
+        'reverse':reverse_list, 'procedure?':is_procedure,
+        'load':Primitive(s_load, need_env=True),
+        'eval':Primitive(s_eval, need_env=True), 'odd?':lambda x: x%2!=0,
+        'apply':Primitive(s_apply, need_env=True), 'map':Primitive(s_map, need_env=True),
+        'list-set!':list_set, 'true': True, 'and':s_and, 'false':False,
         'promise?':lambda x: isa(x,Promise), 'promise-forced?':promise_forced,
-        'promise-value':promise_value,
+        'promise-value':promise_value, 'make-promise':make_promise,
+        'disassemble':vm.disassemble,
+        'eq?':is_eqv, 'eqv?':is_eqv,
+        # fixnum and flonum operations skipping all checks
+        'fx+':op.add, 'fx-':op.sub, 'fx*':op.mul, 'fxquotient':quotient,
+        'fxremainder':remainder, 'fx=':op.eq, 'fx<':op.lt, 'fx>':op.gt,
+        'fx<=':op.le, 'fx>=':op.ge, 'fl+':op.add, 'fl-':op.sub, 'fl*':op.mul,
+        'fl/':op.truediv, 'fl=':op.eq, 'fl<':op.lt, 'fl>':op.gt, 'fl<=':op.le,
+        'fl>=':op.ge,
+        'vector?':is_vector, 'make-vector':make_vector, 'vector':lambda *x: Vector(x),
+        'vector-length':vector_length, 'vector-ref':vector_ref, 'vector-set!':vector_set,
+        'vector->list':vector2list, 'list->vector':list2vector, 'vector-fill!':vector_fill,
+        'vector-map':Primitive(s_vector_map, need_env=True),
+        'vector-for-each':Primitive(s_vector_for_each, need_env=True),
+        'parallel-map':Primitive(s_parallel_map, need_env=True),
+        'parallel-for-each':Primitive(s_parallel_for_each, need_env=True),
+        'set-parallel-workers!':set_parallel_workers,
+        'set-parallel-chunk-size!':set_parallel_chunk_size,
     })
+    numvec.define_primitives(env)
+    hashtable.define_primitives(env)
+    ports.define_primitives(env)
+    memo.define_primitives(env)
+    streams.define_primitives(env)
+    futures.define_primitives(env)
+    for name, val in env.items():
+        if callable(val) and not isa(val, Primitive):
+            val = env[name] = Primitive(val)
+        if isa(val, Primitive):
+            val.name = name
     return env
 
-global_env = _init_global_env(Env())
+_MOD_MSG = 'parameters of mod operation must be integers'
+
+global_env = _init_global_env(SharedEnv())
+global_env.macros = macro.MacroTable()
+vm.apply_primitive = global_env['apply']
+
+# table of macros used and defined by forms being expanded
+_expanding = contextvars.ContextVar('expanding', default=global_env.macros)
+
+def expand(parts, env=global_env):
+    """Expand a statement evaluated in env, with macros of its global environment."""
+    if isa(env, Frame):
+        env = root_env(env.scope)
+    token = _expanding.set(env.macros)
+    try:
+        return _expand(parts, True)
+    finally:
+        _expanding.reset(token)
+
+def _expand_macro(parts, rules, can_define):
+    """Expand a use of a macro, once for the same uses."""
+    expansions = _expanding.get().expansions
+    key = (parts[0], can_define, tostr(parts))
+    result = expansions.get(key)
+    if result is None:
+        result = _expand(rules.expand(parts), can_define)
+        if len(expansions) >= macro.MAX_EXPANSIONS:
+            expansions.clear()
+        expansions[key] = result
+    return result
 
 def _expand(parts, can_define=False):
     """Do expansion for list to be evaluated."""
@@ -95,6 +312,19 @@ def _expand(parts, can_define=False):
     if parts[0] == 'quote':
         require(parts, len(parts)==2)
         return parts
+    if isa(parts[0], Symbol):
+        rules = _expanding.get().get(parts[0])
+        if rules is not None:
+            return _expand_macro(parts, rules, can_define)
+    if parts[0] == 'define-syntax':
+        require(parts, len(parts)==3)
+        name, spec = parts[1:]
+        require_type(isa(name, Symbol), "can only define a symbol")
+        require(spec, isa(spec, list) and spec and spec[0] == 'syntax-rules',
+                'a macro must be defined by syntax-rules')
+        # defined now for forms expanded next, evaluating to its name
+        _expanding.get().define(name, macro.SyntaxRules(spec))
+        return [quotes["'"], name]
     if parts[0] == 'define':
         require(can_define, "can't bind name in null syntactic environment")
         if len(parts) == 2 and not isa(parts[1], list):
@@ -113,6 +343,15 @@ def _expand(parts, can_define=False):
             can_define = False
         parts[2] = _expand(parts[2], can_define)
         return parts
+    if parts[0] == 'define-memoized':
+        require(can_define, "can't bind name in null syntactic environment")
+        require(parts, len(parts)>=3 and isa(parts[1], list) and parts[1])
+        name = parts[1][0]
+        require_type(isa(name, Symbol), "can only define a symbol")
+        # (define-memoized (func parms...) body)
+        #   => (define func (memoize (lambda (parms...) body)))
+        func = _expand(['lambda', parts[1][1:]]+parts[2:], True)
+        return ['define', name, [Symbol('memoize'), func]]
     if parts[0] == 'lambda':
         require(parts, len(parts)>=3)
         parms = parts[1]
@@ -127,6 +366,12 @@ def _expand(parts, can_define=False):
         require_type(isa(symbol, Symbol), "can set! only a symbol")
         parts[2] = _expand(parts[2])
         return parts
+    if parts[0] == 'profile':
+        require(parts, len(parts)==2)
+        return [_profile_call, _expand(['lambda', [], parts[1]])]
+    if parts[0] == 'future':
+        require(parts, len(parts)==2)
+        return [_future_call, _expand(['lambda', [], parts[1]])]
     if parts[0] == 'quasiquote':
         require(parts, len(parts)==2)
         return _expand_quasiquote(parts[1])
@@ -164,8 +409,9 @@ def _expand(parts, can_define=False):
             outer_bind, inner_bind = [[] for i in range(2)]
             for name, val in binds:
                 outer_bind.append([name,None])
-                inner_bind.append([Symbol(name+'.1'),val])
-                inner.append(['set!',name,Symbol(name+'.1')])
+                temp = gensym(name)
+                inner_bind.append([temp,val])
+                inner.append(['set!',name,temp])
             inner += bodies
             inner.insert(1, inner_bind)
             outer.append(outer_bind)
@@ -200,16 +446,19 @@ def _expand(parts, can_define=False):
             parts.append(['else',None])
         else:
             require(parts, len(parts[-1])>1)
-        for cond in parts[1:]:
-            cond = list(map(_expand,cond))
+        parts[1:] = [list(map(_expand,cond)) for cond in parts[1:]]
         return parts
     if parts[0] == 'delay' or parts[0] == 'force':
         require(parts, len(parts)==2)
         if parts[0] == 'delay':
-            # (delay expr) => (delay (memo-proc (lambda () expr)))
-            parts[1] = [Symbol('memo-proc'),['lambda',[],parts[1]]]
+            # (delay expr) => (delay (lambda () expr))
+            parts[1] = ['lambda',[],parts[1]]
         parts[1] = _expand(parts[1])
         return parts
+    if parts[0] == 'cons-stream' or parts[0] == 'stream-cons':
+        require(parts, len(parts)==3)
+        # (cons-stream a b) => (cons a (delay b))
+        return _expand([Symbol('cons'), parts[1], ['delay', parts[2]]])
     if parts[0] == 'case':
         require(parts, len(parts)>2)
         if parts[2:-1]:
@@ -240,26 +489,15 @@ def _expand(parts, can_define=False):
 
 def _list_cat(part1, part2):
     """Catenate two parts into a list."""
-    if isa(part2, List):
-        part2 = part2.members
-    return [part1] + part2
+    return Pair(part1, part2)
 
 def _need_expand_quotes(parts):
     """Judge whether the parts need to be expanded when dealing with quotes."""
     return parts != [] and isa(parts, list)
 
-def _break_list(s_list):
-    """Break the outer list to construct a scheme list."""
-    require_type(isa(s_list, list), 'the parameter must be a list')
-    return List(s_list)
-
 def _add_slist(left_list, right_list):
-    """Add two lists, may be a scheme list."""
-    if isa(left_list, List):
-        left_list = left_list.members
-    if isa(right_list, List):
-        right_list = right_list.members
-    return left_list + right_list
+    """Add two lists, the left one is spliced."""
+    return append(left_list, right_list)
 
 def _expand_quasiquote(parts):
     """Expand parts related to quasiquote."""
@@ -272,259 +510,718 @@ def _expand_quasiquote(parts):
     if _need_expand_quotes(parts[0]) and parts[0][0] == 'unquote-splicing':
         require(parts[0], len(parts[0])==2)
         return [_add_slist, parts[0][1], _expand_quasiquote(parts[1:])]
-    result = [_list_cat, _expand_quasiquote(parts[0]), _expand_quasiquote(parts[1:])]
-    result = [_break_list, result]
-    return result
+    return [_list_cat, _expand_quasiquote(parts[0]), _expand_quasiquote(parts[1:])]
+
+def parse(tokenizer, env=global_env):
+    """Parse scheme statements evaluated in env."""
+    return expand(read_parts(tokenizer), env)
+
+def _analyze(parts, scope, tail=False):
+    """Analyze expanded parts into a procedure executing them in an environment.
+
+    Local variables are resolved against scope to slots in frames. Forms in
+    tail position return a TailCall instead of applying a procedure so that
+    apply_procedure can run them without growing the stack.
+    """
+    if isa(parts, Symbol):
+        return _analyze_symbol(parts, scope)
+    if not isa(parts, list):
+        return lambda env: parts
+    if not parts:
+        return lambda env: []
+    if isa(parts[0], str) and parts[0] in _analyzers:
+        return _analyzers[parts[0]](parts, scope, tail)
+    return _analyze_application(parts, scope, tail)
+
+def _analyze_symbol(symbol, scope):
+    """Analyze reference of a variable."""
+    location = resolve(symbol, scope)
+    if location is None:
+        genv = root_env(scope)
+        def execute(env):
+            try:
+                return genv[symbol]
+            except KeyError:
+                return lookup_unresolved(env, symbol, genv)
+        return execute
+    depth, i = location
+    if i >= frame_at(scope, depth).nparms:
+        # defined inside a body, may be referred before its definition
+        def execute(env):
+            value = frame_at(env, depth).vars[i]
+            if value is UNASSIGNED:
+                raise LookupError('unbound '+symbol)
+            return value
+        return execute
+    if depth == 0:
+        return lambda env: env.vars[i]
+    if depth == 1:
+        return lambda env: env.outer.vars[i]
+    if depth == 2:
+        return lambda env: env.outer.outer.vars[i]
+    return lambda env: frame_at(env, depth).vars[i]
+
+def _analyze_sequence(exprs, scope, tail):
+    """Analyze expressions evaluated in order, returning the last value."""
+    procs = [_analyze(i, scope) for i in exprs[:-1]]
+    last = _analyze(exprs[-1], scope, tail)
+    if not procs:
+        return last
+    def execute(env):
+        for proc in procs:
+            proc(env)
+        return last(env)
+    return execute
+
+def _analyze_quote(parts, scope, tail):
+    """Analyze (quote datum)."""
+    datum = do_quote(parts[1])
+    return lambda env: datum
 
-_quotes = {
-        "'":'quote', '`':'quasiquote', ',':'unquote', ',@':'unquote-splicing',
+def _analyze_define(parts, scope, tail):
+    """Analyze (define symbol value)."""
+    _, symbol, val = parts
+    if not isa(scope, Scope):
+        vproc = _analyze_value(symbol, val, scope)
+        def execute(env):
+            env[symbol] = vproc(env)
+            return symbol
+        return execute
+    # names defined by eval in a frame haven't been scanned
+    i = scope.add(symbol)
+    vproc = _analyze_value(symbol, val, scope)
+    def execute(env):
+        if i >= len(env.vars):
+            env.vars.extend([UNASSIGNED] * (i+1-len(env.vars)))
+        env.vars[i] = vproc(env)
+        return symbol
+    return execute
+
+def _analyze_value(symbol, val, scope):
+    """Analyze value of a definition, naming a lambda after symbol."""
+    if isa(val, list) and val and val[0] == 'lambda':
+        return _analyze_lambda(val, scope, False, symbol)
+    return _analyze(val, scope)
+
+def _analyze_lambda(parts, scope, tail, name=None):
+    """Analyze (lambda parms body), which may be named by define."""
+    new_scope = Scope(parts[1], scan_defines(parts[2]), scope, parts[2], name)
+    body = _analyze(parts[2], new_scope, True)
+    return lambda env: Procedure(new_scope, body, env)
+
+def _analyze_set(parts, scope, tail):
+    """Analyze (set! symbol value) which returns the old value."""
+    _, symbol, val = parts
+    vproc = _analyze(val, scope)
+    location = resolve(symbol, scope)
+    if location is None:
+        def execute(env):
+            old_val = env.find(symbol)[symbol]
+            value = vproc(env)
+            env.find(symbol)[symbol] = value
+            return old_val
+        return execute
+    depth, i = location
+    def execute(env):
+        frame = frame_at(env, depth)
+        old_val = frame.vars[i]
+        if old_val is UNASSIGNED:
+            raise LookupError('unbound '+symbol)
+        frame.vars[i] = vproc(env)
+        return old_val
+    return execute
+
+def _analyze_delay(parts, scope, tail):
+    """Analyze (delay expr) whose expr has been wrapped by a lambda."""
+    pproc = _analyze(parts[1], scope)
+    return lambda env: Promise(pproc(env))
+
+def _analyze_force(parts, scope, tail):
+    """Analyze (force promise)."""
+    pproc = _analyze(parts[1], scope)
+    def execute(env):
+        promise = pproc(env)
+        if type(promise) is Promise and promise.forced:
+            return promise.value
+        return force(promise, env)
+    return execute
+
+def _analyze_case(parts, scope, tail):
+    """Analyze (case key clauses...) whose last clause is else."""
+    kproc = _analyze(parts[1], scope)
+    clauses = [(_analyze(i[0], scope), _analyze_sequence(i[1:], scope, tail))
+            for i in parts[2:-1]]
+    else_body = _analyze_sequence(parts[-1][1:], scope, tail)
+    def execute(env):
+        key = kproc(env)
+        for datums, body in clauses:
+            if key in datums(env):
+                return body(env)
+        return else_body(env)
+    return execute
+
+def _analyze_cond(parts, scope, tail):
+    """Analyze (cond clauses...) whose last clause is else."""
+    clauses = [(_analyze(i[0], scope),
+                _analyze_sequence(i[1:], scope, tail) if i[1:] else None)
+            for i in parts[1:-1]]
+    else_body = _analyze_sequence(parts[-1][1:], scope, tail)
+    def execute(env):
+        for test, body in clauses:
+            do_branch = test(env)
+            # (cond ('() 3)) is valid
+            if do_branch or isa(do_branch, list):
+                if body is None:
+                    return do_branch
+                return body(env)
+        return else_body(env)
+    return execute
+
+def _analyze_do(parts, scope, tail):
+    """Analyze do form expanded into (do parms inits steps cond ret_val bodies)."""
+    _, parms, inits, steps, cond, ret_val, bodies = parts
+    inits = [_analyze(i, scope) for i in inits]
+    do_scope = Scope(list(parms), scan_defines(bodies), scope)
+    steps = [_analyze(i, do_scope) for i in steps]
+    cond = _analyze(cond, do_scope)
+    ret_val = _analyze(ret_val, do_scope, tail)
+    bodies = [_analyze(i, do_scope) for i in bodies]
+    nparms = len(parms)
+    def execute(env):
+        env = Frame([i(env) for i in inits] + do_scope.padding, env, do_scope)
+        while not cond(env):
+            if scheme_types.step_hook is not None:
+                scheme_types.step_hook()
+            for i in bodies:
+                i(env)
+            env.vars[:nparms] = [i(env) for i in steps]
+        return ret_val(env)
+    return execute
+
+def _analyze_begin(parts, scope, tail):
+    """Analyze (begin exprs...)."""
+    return _analyze_sequence(parts[1:], scope, tail)
+
+def _analyze_application(parts, scope, tail):
+    """Analyze (proc args...)."""
+    fproc = _analyze(parts[0], scope)
+    aprocs = [_analyze(i, scope) for i in parts[1:]]
+    if len(aprocs) == 1:
+        return _analyze_call1(fproc, aprocs[0], tail)
+    if len(aprocs) == 2:
+        return _analyze_call2(fproc, aprocs[0], aprocs[1], tail)
+    def execute(env):
+        func = fproc(env)
+        args = [i(env) for i in aprocs]
+        if isa(func, Procedure):
+            if tail:
+                return TailCall(func, args)
+            return apply_procedure(func, args, env)
+        return call_primitive(func, args, env)
+    return execute
+
+def _analyze_call1(fproc, aproc, tail):
+    """Analyze application with one argument, trying the fast path of primitives."""
+    def execute(env):
+        func = fproc(env)
+        if type(func) is Primitive and func.fast1 is not None:
+            return func.fast1(aproc(env))
+        # arguments are only kept in the list, which primitives may clear
+        args = [aproc(env)]
+        if isa(func, Procedure):
+            if tail:
+                return TailCall(func, args)
+            return apply_procedure(func, args, env)
+        return call_primitive(func, args, env)
+    return execute
+
+def _analyze_call2(fproc, aproc1, aproc2, tail):
+    """Analyze application with two arguments, trying the fast path of primitives."""
+    def execute(env):
+        func = fproc(env)
+        if type(func) is Primitive and func.fast2 is not None:
+            return func.fast2(aproc1(env), aproc2(env))
+        args = [aproc1(env), aproc2(env)]
+        if isa(func, Procedure):
+            if tail:
+                return TailCall(func, args)
+            return apply_procedure(func, args, env)
+        return call_primitive(func, args, env)
+    return execute
+
+_analyzers = {
+        'quote': _analyze_quote, 'define': _analyze_define, 'lambda': _analyze_lambda,
+        'set!': _analyze_set, 'delay': _analyze_delay, 'force': _analyze_force,
+        'case': _analyze_case, 'cond': _analyze_cond, 'do': _analyze_do,
+        'begin': _analyze_begin,
 }
 
-quotes = {s:Symbol(_quotes[s]) for s in _quotes}
-
-def parse(tokenizer):
-    """Parse scheme statements."""
-    return _expand(_read(tokenizer), True)
-
-def _read(tokenizer):
-    """Read symbol to parse."""
-    def _read_ahead(token):
-        """Read ahead to construct an operation."""
-        if token in quotes:
-            return [quotes[token], _read(tokenizer)]
-        if token == '(':
-            members = []
-            while True:
-                token = tokenizer.next_token()
-                if token == ')':
-                    return members
-                new_token = _read_ahead(token)
-                if new_token != ';':
-                    members.append(new_token)
-        else:
-            return transform(token)
-    # body of parse
-    token = tokenizer.next_token()
-    if token is None:
-        return None
-    if token.startswith(';'):
-        return ';'
-    return _read_ahead(token)
+# compiler of expanded forms, replaced by vm.compile_code with --vm
+_compile = _analyze
+
+# A non-tail call of an analyzed procedure takes about four python frames,
+# against two of the recursive evaluator before it, so the limit allows
+# 2500 nested calls. Python calling python doesn't grow the C stack, and
+# calls through primitives like map and apply stay within the default 8MB
+# stack of threads at this depth.
+_RECURSION_LIMIT = 10000
+sys.setrecursionlimit(max(sys.getrecursionlimit(), _RECURSION_LIMIT))
 
-def _findop(func, op_list):
-    """Judge whether the operator is in the list."""
+def evaluate(parts, env=global_env, limits=None):
+    """Evaluate value of parts, within limits of fuel if given."""
+    if limits is not None:
+        with limiting(limits):
+            return evaluate(parts, env)
+    scope = env.scope if isa(env, Frame) else env
+    result = _compile(parts, scope)(env)
+    if type(result) is TailCall:
+        # left by bytecode when profiling
+        return apply_procedure(result.func, result.args, env)
+    return result
+
+@contextlib.contextmanager
+def _calling_through(apply, call):
+    """Make both evaluators call procedures through apply and primitives through call."""
+    global apply_procedure, call_primitive
+    saved = (apply_procedure, call_primitive, vm.apply_procedure, vm._inline_code, vm._tail_call)
+    primitives = list({id(i): i for i in list(global_env.values()) + list(_primitives.values())
+            if isa(i, Primitive)}.values())
+    fast_paths = [(i.fast1, i.fast2) for i in primitives]
+    apply_procedure = vm.apply_procedure = apply
+    call_primitive = call
+    vm._inline_code = None
+    vm._tail_call = vm._leave_tail_call
+    for i in primitives:
+        i.fast1 = i.fast2 = None
     try:
-        return func in op_list
-    except Exception:
-        return False
-
-def _mathop(func):
-    """Judge whether operator is a math one."""
-    return _findop(func, [lcm,fractions.gcd,op.add,op.sub,op.mul,op.truediv])
-
-def _cmpop(func):
-    """Judge whether operator is a comparison one."""
-    return _findop(func, [op.is_,op.lt,op.le,op.gt,op.ge])
-
-def _modop(func):
-    """Judge whether the operator is related to mod."""
-    return _findop(func, [remainder,op.mod,quotient])
-
-def _do_math_op(func, exprs):
-    """Deal with basic math operator."""
-    import functools
-    if func is fractions.gcd:
-        require_type(all(isa(i,int) for i in exprs),
-                'parameters of gcd must be integers')
-        exprs.insert(0, 0)
-    elif func is lcm:
-        require_type(all(isa(i,int) for i in exprs),
-                'parameters of lcm must be integers')
-        exprs.insert(0, 1)
-    elif func is op.add and len(exprs) == 0:
-        exprs.append(0)
-    elif func is op.mul and len(exprs) == 0:
-        exprs.append(1)
-    elif func is op.sub and len(exprs) == 1:
-        exprs.insert(0, 0)
-    elif func is op.truediv and len(exprs) == 1:
-        exprs.insert(0, 1)
-    elif func is op.truediv:
-        molecular = exprs.pop(0)
-        sum = functools.reduce(op.mul, exprs)
-        try:
-            return fractions.Fraction(molecular, sum)
-        except TypeError:
-            # when molecular or sum is a float
-            return molecular / sum
-    return functools.reduce(func, exprs)
-
-def _do_cmp_op(func, exprs):
-    """Do comparable operation."""
-    for i in range(len(exprs)-1):
-        if not func(exprs[i], exprs[i+1]):
-            return False
-    return True
-
-def _do_mod_op(func, exprs):
-    """Do operations related to mod."""
-    require(exprs, len(exprs)==2)
-    require_type(isa(exprs[0],int) and isa(exprs[1],int),
-            'parameters of mod operation must be integers')
-    return func(*exprs)
-
-_special_forms = {
-        _mathop: _do_math_op, _cmpop: _do_cmp_op, _modop: _do_mod_op,
-}
+        yield
+    finally:
+        (apply_procedure, call_primitive, vm.apply_procedure,
+                vm._inline_code, vm._tail_call) = saved
+        for i, (fast1, fast2) in zip(primitives, fast_paths):
+            i.fast1, i.fast2 = fast1, fast2
 
-_need_env = [s_eval, s_apply, s_map]
+# profiler of the evaluation running in the current context
+_profiler = contextvars.ContextVar('profiler', default=None)
 
-def _do_quote(parts):
-    """Return pair or list if possible when returning from quote."""
-    if not _need_expand_quotes(parts):
-        return parts
-    if parts.count('.')>1 or parts.count('.')==1 and parts.index('.')<len(parts)-2:
-        require(parts, False, 'ill-formed dotted list')
-    if len(parts) >= 3 and parts[-2] == '.':
-        return Pair(_do_quote(parts[0]), _do_quote(parts[1:]))
-    return List(parts)
-
-def _deal_special(func, exprs):
-    """Deal with special functions."""
-    for is_op in _special_forms:
-        if is_op(func):
-            return _special_forms[is_op](func, exprs)
-
-def evaluate(parts, env=global_env):
-    """Evaluate value of parts."""
-    while True:
-        if isa(parts, Symbol):
-            return env.find(parts)[parts]
-        if not isa(parts, list):
-            return parts
-        if not parts:
-            return []
-        if parts[0] == 'quote':
-            return _do_quote(parts[1])
-        if parts[0] == 'define':
-            _, symbol, val = parts
-            env[symbol] = evaluate(val, env)
-            return symbol
-        if parts[0] == 'lambda':
-            # get parameters and body of lambda
-            return Procedure(parts[1], parts[2], env)
-        if parts[0] == 'set!':
-            _, symbol, value = parts
-            oldVal = env.find(symbol)[symbol]
-            env.find(symbol)[symbol] = evaluate(value, env)
-            return oldVal
-        if parts[0] == 'delay':
-            return Promise(evaluate(parts[1],env))
-        if parts[0] == 'force':
-            parts[1] = evaluate(parts[1], env)
-            require_type(isa(parts[1],Promise), 'parameter of force must be a promise')
-            parts = [parts[1].exprs]
-        elif parts[0] == 'case':
-            expr = evaluate(parts[1], env)
-            for case in parts[2:-1]:
-                if expr in evaluate(case[0],env):
-                    parts = ['begin'] + case[1:]
-                    return evaluate(parts, env)
-            parts = ['begin'] + parts[-1][1:]
-        elif parts[0] == 'cond':
-            for cond in parts[1:-1]:
-                do_branch = evaluate(cond[0], env)
-                # (cond ('() 3)) is valid
-                if do_branch or isa(do_branch, list):
-                    parts = cond[1:]
-                    if not parts:
-                        return do_branch
-                    parts.insert(0, 'begin')
-                    return evaluate(parts, env)
-            parts = ['begin'] + parts[-1][1:]
-        elif parts[0] == 'do':
-            _, parms, inits, steps, cond, ret_val, bodies = parts
-            env = Env(outer=env)
-            init_vals = [evaluate(i, env) for i in inits]
-            env.update(zip(parms,init_vals))
-            while not evaluate(cond, env):
-                for i in bodies[0:]:
-                    evaluate(i, env)
-                new_vals = [evaluate(i, env) for i in steps]
-                env.update(zip(parms,new_vals))
-            parts = ret_val
-        elif parts[0] == 'begin':
-            for i in parts[1:-1]:
-                evaluate(i, env)
-            parts = parts[-1]
-        else:
-            # (proc args...)
-            exprs = [evaluate(i, env) for i in parts]
-            func = exprs.pop(0)
-            for is_op in _special_forms:
-                if is_op(func):
-                    return _special_forms[is_op](func, exprs)
-            if func is List:
-                return List(exprs)
-            if isa(func, Procedure):
-                parts = func.body
-                env = Env(func.parms, exprs, func.env)
-            else:
-                if func in _need_env:
-                    exprs.append(env)
-                result = func(*exprs)
-                # set-car and set-cdr may change pair into list or conversely
-                if isa(parts[0], str) and parts[0].startswith('set-'):
-                    try:
-                        env.update({parts[1]:result})
-                    except TypeError:
-                        # the changed object may temporary
-                        return result
-                    except Exception as e:
-                        raise e
-                return result
-
-def repl(in_from=sys.stdin):
-    """Read-evaluate-print-loop."""
-    prompt = '> '
-    tokenizer = Tokenizer(in_from)
+# evaluations profiled in all contexts, and the hooks installed for them
+_profiled = 0
+_profiled_hooks = None
+_profiled_lock = threading.Lock()
+
+def _profiled_apply(func, args, env):
+    """Apply func through the profiler of the current context, if it has one."""
+    prof = _profiler.get()
+    if prof is None:
+        return scheme_types.apply_procedure(func, args, env)
+    return prof.apply_procedure(func, args, env)
+
+def _profiled_call(func, args, env):
+    """Call a primitive through the profiler of the current context, if it has one."""
+    prof = _profiler.get()
+    if prof is None:
+        return scheme_types.call_primitive(func, args, env)
+    return prof.call_primitive(func, args, env)
+
+@contextlib.contextmanager
+def profiling(prof):
+    """Measure calls in the current context by prof.
+
+    Both evaluators call through the profiler of their context while any
+    context is profiled, so evaluation costs nothing more otherwise.
+    """
+    global _profiled, _profiled_hooks
+    with _profiled_lock:
+        if not _profiled:
+            _profiled_hooks = _calling_through(_profiled_apply, _profiled_call)
+            _profiled_hooks.__enter__()
+        _profiled += 1
+    token = _profiler.set(prof)
+    try:
+        yield prof
+    finally:
+        _profiler.reset(token)
+        with _profiled_lock:
+            _profiled -= 1
+            if not _profiled:
+                _profiled_hooks.__exit__(None, None, None)
+                _profiled_hooks = None
+
+def _profile_thunk(thunk, env):
+    """Call thunk made by (profile expr), printing measurements of calls in it."""
+    with profiling(profiler.Profiler()) as prof:
+        result = apply_procedure(thunk, [], env)
+    prof.report()
+    return result
+
+def _future_thunk(thunk, env):
+    """Call thunk made by (future expr) in another thread."""
+    return futures.spawn(thunk, env)
+
+# called by expanded forms, with the environment of the caller
+_profile_call = Primitive(_profile_thunk, need_env=True)
+_future_call = Primitive(_future_thunk, need_env=True)
+
+def repl(in_from=sys.stdin, env=global_env, prompt='> ', limits=None):
+    """Read-evaluate-print-loop, evaluating every statement within limits if given."""
+    # share the buffer with (read) from the console
+    tokenizer = ports.current_input().tokenizer if in_from is sys.stdin else Tokenizer(in_from)
     while True:
         try:
-            if tokenizer.empty():
+            if prompt and tokenizer.empty():
                 sys.stderr.write(prompt)
-            sys.stderr.flush()
-            parts = parse(tokenizer)
+                sys.stderr.flush()
+            parts = parse(tokenizer, env)
             if parts is None:
                 return
-            if parts == ';' or parts == ')':
+            if parts == ')':
                 continue
-            print(tostr(evaluate(parts)))
+            print(tostr(evaluate(parts, env, limits)))
         except KeyboardInterrupt:
             sys.stderr.write('\n')
             sys.stderr.flush()
         except Exception as e:
-            print("{0}: {1}".format(type(e).__name__, e))
-
-# use this to implement delay
-_pre_procedure = """
-    (define (memo-proc proc)
-        (let ((already-run? #f) (result #f))
-            (lambda ()
-                (if (not already-run?)
-                (begin (set! result (proc))
-                        (set! already-run? #t)
-                        result)
-                result))))
-"""
-
-try:
-    from io import StringIO
-    evaluate(parse(Tokenizer(StringIO(_pre_procedure))))
-except TypeError:
-    # make it compatible with python2 when debugging with winpdb
-    from StringIO import StringIO
-    evaluate(parse(Tokenizer(StringIO(_pre_procedure))))
+            _print_error(e)
 
-if __name__ == '__main__':
-    repl()
+def run_batch(filenames, limits=None):
+    """Evaluate files, or stdin if none, without prompts or printing values.
+
+    Line buffering of stdout is turned off meanwhile, so output is written
+    whenever the buffer of stdout fills rather than at every line. It stops
+    at the first error, which is reported with the file and line of its
+    statement, or the file if it can't be read, returning 1. Every
+    statement is evaluated within limits if given.
+    """
+    stdout = sys.stdout
+    line_buffered = getattr(stdout, 'line_buffering', False) and hasattr(stdout, 'reconfigure')
+    if line_buffered:
+        stdout.reconfigure(line_buffering=False)
+    try:
+        for filename in filenames or [None]:
+            if filename is None:
+                filename = '<stdin>'
+                # share the buffer with (read) from the console
+                forms = _read_forms(ports.current_input().tokenizer)
+            else:
+                try:
+                    with open(filename, 'rb') as f:
+                        forms = _load_cache(filename, f.read())
+                except (OSError, UnicodeDecodeError) as e:
+                    _batch_error(filename, e)
+                    return 1
+            for line, parts in forms:
+                try:
+                    if isa(parts, Exception):
+                        raise parts
+                    evaluate(expand(parts), global_env, limits)
+                except Exception as e:
+                    _batch_error('{0}:{1}'.format(filename, line), e)
+                    return 1
+        return 0
+    finally:
+        stdout.flush()
+        if line_buffered:
+            stdout.reconfigure(line_buffering=True)
+
+def _batch_error(where, e):
+    """Report an error met in batch mode after what's printed before it."""
+    sys.stdout.flush()
+    sys.stderr.write('{0}: {1}: {2}\n'.format(where, type(e).__name__, e))
+
+def _serve_session(lines, limits=None):
+    """Run the repl of a session of a server, reading lines of its client.
+
+    It defines names and macros in an environment of its own over the
+    global one, and reads the console from its client.
+    """
+    env = Env(outer=global_env)
+    env.macros = macro.MacroTable(global_env.macros)
+    with ports.reading_console(lines):
+        repl(env=env, prompt=None, limits=limits)
+
+def _print_error(e):
+    """Print an error met in the repl."""
+    print("{0}: {1}".format(type(e).__name__, e))
+
+# bump it when the layout of images changes
+_IMAGE_VERSION = 5
+_DEEP_STACK_SIZE = 1 << 28
+_DEEP_RECURSION_LIMIT = 1000000
+
+# deep calls running, which keep the recursion limit raised, and the limit before them
+_deep_calls = 0
+_deep_saved_limit = None
+_deep_lock = threading.Lock()
+
+# primitives are saved in images by name
+_primitives = {name: val for name, val in global_env.items() if isa(val, Primitive)}
+
+# bodies compiled for scopes of procedures restored from an image
+_restored_bodies = {}
+
+class _ImagePickler(pickle.Pickler):
+    """Pickler of values in the global environment."""
+    def persistent_id(self, obj):
+        """Refer to the global environment and primitives instead of saving them."""
+        if obj is global_env:
+            return ('env',)
+        if isa(obj, Primitive) and _primitives.get(obj.name) is obj:
+            return ('primitive', obj.name)
+        return None
+    def reducer_override(self, obj):
+        """Save a procedure without its compiled body."""
+        if type(obj) is Procedure:
+            return _restore_procedure, (obj.scope, obj.env)
+        return NotImplemented
 
+class _ImageUnpickler(pickle.Unpickler):
+    """Unpickler of values in the global environment."""
+    def persistent_load(self, pid):
+        """Get the global environment or a primitive referred in the image."""
+        if pid[0] == 'env':
+            return global_env
+        return _primitives[pid[1]]
+
+def _restore_procedure(scope, env):
+    """Rebuild a procedure, compiling its body once for each scope."""
+    body = _restored_bodies.get(scope)
+    if body is None:
+        if _compile is _analyze:
+            body = _analyze(scope.source, scope, True)
+        else:
+            body = _compile(scope.source, scope)
+        _restored_bodies[scope] = body
+    return Procedure(scope, body, env)
+
+def _image_key():
+    """Get the key of images this interpreter can restore."""
+    return (_IMAGE_VERSION, sys.implementation.cache_tag, __name__)
+
+def _deep_call(func, *args):
+    """Call func in a thread with a large stack, so that pickle can follow long lists.
+
+    The recursion limit is raised while any deep call runs, and restored
+    by the last of them. Only the thread started here gets the large stack.
+    """
+    global _deep_calls, _deep_saved_limit
+    outcome = {}
+    def target():
+        try:
+            outcome['value'] = func(*args)
+        except Exception as e:
+            outcome['error'] = e
+    with _deep_lock:
+        if not _deep_calls:
+            _deep_saved_limit = sys.getrecursionlimit()
+            sys.setrecursionlimit(max(_deep_saved_limit, _DEEP_RECURSION_LIMIT))
+        _deep_calls += 1
+    try:
+        with _deep_lock:
+            old_size = threading.stack_size(_DEEP_STACK_SIZE)
+            try:
+                thread = threading.Thread(target=target)
+                thread.start()
+            finally:
+                threading.stack_size(old_size)
+        thread.join()
+    finally:
+        with _deep_lock:
+            _deep_calls -= 1
+            if not _deep_calls:
+                sys.setrecursionlimit(_deep_saved_limit)
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['value']
+
+def save_image(filename):
+    """Save the global environment with procedures and macros defined in it to an image."""
+    def dump():
+        with open(filename, 'wb') as f:
+            f.write(pickle.dumps(_image_key(), pickle.HIGHEST_PROTOCOL))
+            _ImagePickler(f, pickle.HIGHEST_PROTOCOL).dump((dict(global_env),
+                    global_env.macros.macros))
+    _deep_call(dump)
+
+def load_image(filename):
+    """Restore the global environment from an image."""
+    def load():
+        with open(filename, 'rb') as f:
+            require_type(pickle.load(f) == _image_key(),
+                    '{0} is saved by an incompatible interpreter'.format(filename))
+            return _ImageUnpickler(f).load()
+    try:
+        env, macros = _deep_call(load)
+        global_env.update(env)
+        global_env.macros.update(macros)
+    finally:
+        _restored_bodies.clear()
+
+# workers and calls in a chunk of parallel-map, chosen by the work if None
+_parallel_workers = None
+_parallel_chunk_size = None
+
+# procedure called by a worker process
+_parallel_proc = None
+
+def _dumps(obj):
+    """Pickle obj as images do, referring to the global environment and primitives."""
+    f = io.BytesIO()
+    _ImagePickler(f, pickle.HIGHEST_PROTOCOL).dump(obj)
+    return f.getvalue()
+
+def _loads(data):
+    """Unpickle obj pickled by _dumps."""
+    try:
+        return _ImageUnpickler(io.BytesIO(data)).load()
+    finally:
+        _restored_bodies.clear()
+
+def _parallel_context():
+    """Get the context starting workers, forking them where it's safe.
+
+    Forking while other threads run, like sessions of a server or threads
+    of futures, could leave locks they hold locked in workers, so workers
+    are started by a fork server or spawned then.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    if 'fork' in methods and threading.active_count() == 1:
+        return multiprocessing.get_context('fork')
+    if 'forkserver' in methods:
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+def _worker_image():
+    """Pickle the global environment for workers which aren't forked.
+
+    Variables whose values can't be pickled, like futures and ports, are
+    left out, so workers find them unbound.
+    """
+    env = dict(global_env)
+    try:
+        return _dumps((env, global_env.macros.macros))
+    except (pickle.PicklingError, TypeError, AttributeError):
+        pass
+    for name, val in list(env.items()):
+        try:
+            _dumps(val)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            del env[name]
+    return _dumps((env, global_env.macros.macros))
+
+def _parallel_apply(proc, members):
+    """Apply proc to every tuple of members in a pool of worker processes.
+
+    Workers get the procedure once with the environment it captures, and
+    chunks of arguments pickled as images are. Forked workers share the
+    global environment as it is, while others restore it from an image.
+    """
+    if not members:
+        return []
+    workers = _parallel_workers or os.cpu_count() or 1
+    size = _parallel_chunk_size or -(-len(members) // (workers*4))
+    chunks = [members[i:i+size] for i in range(0, len(members), size)]
+    context = _parallel_context()
+    image = None
+    if context.get_start_method() != 'fork':
+        image = _deep_call(_worker_image)
+    proc_data = _deep_call(_dumps, proc)
+    chunks = _deep_call(lambda: [_dumps(i) for i in chunks])
+    # forked workers would write what's buffered again
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with context.Pool(min(workers, len(chunks)), _parallel_init, (image, proc_data)) as pool:
+        results = pool.map(_parallel_task, chunks, chunksize=1)
+    return [j for i in results for j in _deep_call(_loads, i)]
+
+def _parallel_init(image, proc_data):
+    """Prepare a worker process to call the procedure."""
+    global _parallel_proc
+    if image is not None:
+        env, macros = _deep_call(_loads, image)
+        global_env.update(env)
+        global_env.macros.update(macros)
+    _parallel_proc = _deep_call(_loads, proc_data)
+
+def _parallel_task(data):
+    """Call the procedure with every arguments in a chunk, in a worker process."""
+    def run():
+        return _dumps([apply_procedure(_parallel_proc, list(i), global_env)
+            for i in _loads(data)])
+    try:
+        return _deep_call(run)
+    finally:
+        # workers are terminated without flushing
+        sys.stdout.flush()
+
+def main():
+    """Parse command line arguments and run the repl."""
+    global _compile
+    parser = argparse.ArgumentParser(description='Scheme interpreter.')
+    parser.add_argument('--vm', action='store_true',
+            help='compile to bytecode run by a virtual machine without recursion limit')
+    parser.add_argument('--image', metavar='FILE',
+            help='start from an image saved by --save-image')
+    parser.add_argument('--profile', action='store_true',
+            help='print calls and time of procedures when the run ends')
+    # what's done after loading files
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument('--save-image', metavar='FILE',
+            help='save an image after loading files and exit')
+    modes.add_argument('--batch', action='store_true',
+            help='run files, or stdin if none, without the repl and stop at the first error; '
+            'the default when stdin is not a terminal')
+    modes.add_argument('-i', '--interactive', action='store_true',
+            help='run the repl even if stdin is not a terminal')
+    modes.add_argument('--serve', metavar='ADDRESS',
+            help='serve sessions at a port of localhost or a unix socket path')
+    parser.add_argument('--max-steps', metavar='N', type=int,
+            help='stop evaluating a statement after N calls and loop iterations')
+    parser.add_argument('--timeout', metavar='SECONDS', type=float,
+            help='stop evaluating a statement after SECONDS')
+    parser.add_argument('--max-memory', metavar='BYTES', type=int,
+            help='stop evaluating a statement holding more than BYTES allocated')
+    parser.add_argument('files', nargs='*', help='files to load before the repl')
+    args = parser.parse_args()
+    if args.vm:
+        _compile = vm.compile_code
+    if args.image:
+        load_image(args.image)
+    if not args.profile:
+        return _run(args)
+    with profiling(profiler.Profiler()) as prof:
+        try:
+            return _run(args)
+        finally:
+            prof.report()
+
+def _limits(args):
+    """Get limits of statements given in command line, or None."""
+    if args.max_steps is None and args.timeout is None and args.max_memory is None:
+        return None
+    return Fuel(args.max_steps, args.timeout, args.max_memory)
+
+def _run(args):
+    """Load files given in command line, then save an image or run the repl, returning exit status."""
+    limits = _limits(args)
+    if args.batch or not (args.interactive or args.files or args.serve
+            or args.save_image or sys.stdin.isatty()):
+        return run_batch(args.files, limits)
+    for filename in args.files:
+        load_file(filename)
+    if args.save_image:
+        save_image(args.save_image)
+        return
+    if args.serve:
+        # only serving needs asyncio, which is slow to import
+        import server
+        global_env.share()
+        try:
+            server.serve(args.serve, lambda lines: _serve_session(lines, limits))
+        except OSError as e:
+            sys.stderr.write('cannot serve on {0}: {1}\n'.format(args.serve, e))
+            return 1
+        return
+    repl(limits=limits)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,19 +1,27 @@
 #!/usr/bin/env python3
 
+import array
 import fractions
+import functools
+import itertools
+import math
+import operator as op
 import sys
+import weakref
 
 class Env(dict):
     """Context Environment."""
     def __init__(self, parms=(), args=(), outer=None):
         """Initialize the environment with specific parameters."""
         self._outer = outer
+        # table of macros defined in it, set for global environments
+        self.macros = None
         if isa(parms, Symbol):
         # (lambda x (...))
-            self.update({parms:list(args)})
+            self.update({parms:seq2list(args)})
         else:
-            require_type(len(parms)==len(args),
-                    'expected {0}, given {1}'.format(tostr(parms),tostr(args)))
+            if len(parms) != len(args):
+                raise TypeError('expected {0}, given {1}'.format(tostr(parms),tostr(args)))
             self.update(zip(parms, args))
     def find(self, op):
         """Find operator in the environment."""
@@ -25,162 +33,501 @@ class Env(dict):
             raise LookupError('unbound '+op)
         return self._outer.find(op)
 
+class SharedEnv(Env):
+    """Global environment, which none can change once sessions share it.
+
+    Procedures defined in it before refer to it rather than to a copy, so
+    they can't change it for other sessions either.
+    """
+    shared = False
+    def share(self):
+        """Refuse to change variables from now on."""
+        self.shared = True
+    def __setitem__(self, name, value):
+        """Set a variable, refusing once it's shared."""
+        if self.shared:
+            raise TypeError("can't set! shared variable {0}, define it instead".format(name))
+        dict.__setitem__(self, name, value)
+
+class Scope:
+    """Names bound by a lambda or do form, resolved to slots when analyzing."""
+    __slots__ = ('parms', 'nparms', 'arity', 'index', 'padding', 'outer', 'source', 'name')
+    def __init__(self, parms, defines, outer, source=None, name=None):
+        """Lay out parameters followed by names defined inside the body."""
+        self.parms = parms
+        self.outer = outer
+        # expanded body of a lambda, compiled again when restored from an image
+        self.source = source
+        # name of a lambda given by define
+        self.name = name
+        names = [parms] if isa(parms, Symbol) else list(parms)
+        self.nparms = len(names)
+        # the count of arguments expected, -1 when it takes any number
+        self.arity = -1 if isa(parms, Symbol) else self.nparms
+        self.index = {}
+        for i, name in enumerate(names):
+            self.index[name] = i
+        self.padding = []
+        for name in defines:
+            self.add(name)
+    def add(self, name):
+        """Add a slot for name if needed and return its index."""
+        if name not in self.index:
+            self.index[name] = self.nparms + len(self.padding)
+            self.padding.append(UNASSIGNED)
+        return self.index[name]
+
+class Frame:
+    """Runtime environment of a scope, holding its values in slots."""
+    __slots__ = ('vars', 'outer', 'scope')
+    def __init__(self, vars, outer, scope):
+        """Bind values in vars to names laid out by scope."""
+        self.vars = vars
+        self.outer = outer
+        self.scope = scope
+    def find(self, op):
+        """Find the environment where op is bound, like Env.find."""
+        if op in self.scope.index:
+            return self
+        return self.outer.find(op)
+    def __getitem__(self, op):
+        """Get value bound to op in this frame."""
+        return self.vars[self.scope.index[op]]
+    def __setitem__(self, op, val):
+        """Set value bound to op in this frame."""
+        self.vars[self.scope.index[op]] = val
+
+class _Unassigned:
+    """Value of a slot whose name hasn't been defined yet."""
+    __slots__ = ()
+    def __reduce__(self):
+        """Unpickle as the only instance."""
+        return 'UNASSIGNED'
+
+UNASSIGNED = _Unassigned()
+
 class Procedure:
     """Class for procedure."""
-    def __init__(self, parms, body, env):
-        """Initialize a procedure with specific parameters, arguments and environment."""
-        self.parms = parms
+    def __init__(self, scope, body, env):
+        """Initialize a procedure with its scope, analyzed body and environment."""
+        self.scope = scope
         self.body = body
         self.env = env
+    @property
+    def parms(self):
+        """Return parameters of the procedure."""
+        return self.scope.parms
+
+    def collect_args(self, args):
+        """Collect arguments of (lambda x ...) or complain about a wrong count."""
+        if isa(self.parms, Symbol):
+            # (lambda x (...))
+            return [seq2list(args)]
+        raise TypeError('expected {0}, given {1}'.format(tostr(self.parms), tostr(args)))
+
+def _arity(func):
+    """Return the least and most numbers of arguments func takes."""
+    import inspect
+    try:
+        parms = inspect.signature(func).parameters.values()
+    except (TypeError, ValueError):
+        return 0, None
+    positional = [i for i in parms if i.kind in (i.POSITIONAL_ONLY, i.POSITIONAL_OR_KEYWORD)]
+    least = len([i for i in positional if i.default is i.empty])
+    if any(i.kind == i.VAR_POSITIONAL for i in parms):
+        return least, None
+    return least, len(positional)
+
+class Primitive:
+    """Descriptor of a procedure implemented in python.
+
+    The arity is taken from the signature of func unless given. check is a
+    predicate every argument must satisfy, and functions with need_env get
+    the environment of the caller as an extra argument. fast1 and fast2 are
+    called directly with one or two arguments, skipping all checks; they
+    default to func if it can be called that way without any check.
+    Functions with own_args get the list of arguments itself, which they
+    may clear so that its members can be freed while they run.
+    """
+    __slots__ = ('name', 'func', 'min_args', 'max_args', 'check', 'msg',
+            'need_env', 'own_args', 'fast1', 'fast2')
+    def __init__(self, func, arity=None, check=None, msg=None, need_env=False,
+            fast1=None, fast2=None, own_args=False):
+        """Describe func with its arity, checks and fast paths."""
+        self.name = getattr(func, '__name__', '?')
+        self.func = func
+        if arity is None:
+            arity = _arity(func)
+            if need_env:
+                arity = arity[0]-1, arity[1] if arity[1] is None else arity[1]-1
+        self.min_args, self.max_args = arity
+        self.check = check
+        self.msg = msg
+        self.need_env = need_env
+        self.own_args = own_args
+        plain = check is None and not need_env and not own_args
+        if fast1 is None and plain and self._takes(1):
+            fast1 = func
+        if fast2 is None and plain and self._takes(2):
+            fast2 = func
+        self.fast1 = fast1
+        self.fast2 = fast2
+    def _takes(self, num):
+        """Judge whether it can be called with num arguments."""
+        return self.min_args <= num and (self.max_args is None or num <= self.max_args)
+    def apply(self, args, env):
+        """Call the procedure with a list of arguments after checking them."""
+        if not self._takes(len(args)):
+            raise TypeError('{0}: expected {1} arguments, given {2}'.format(
+                self.name, self._arity_str(), len(args)))
+        if self.check is not None:
+            require_type(all(map(self.check, args)), self.msg)
+        if self.need_env:
+            args.append(env)
+        if self.own_args:
+            return self.func(args)
+        return self.func(*args)
+    def _arity_str(self):
+        """Format the arity for error messages."""
+        if self.max_args is None:
+            return 'at least {0}'.format(self.min_args)
+        if self.min_args == self.max_args:
+            return str(self.min_args)
+        return '{0} to {1}'.format(self.min_args, self.max_args)
+    def __call__(self, *args):
+        """Call the procedure from python."""
+        if self.own_args:
+            return self.func(list(args))
+        return self.func(*args)
+    def __str__(self):
+        """Return string form."""
+        return '#<primitive {0}>'.format(self.name)
 
 class Symbol(str):
     """Class for symbol."""
     pass
 
-def _property(attr):
-    """Get attribute of a class. It's a closure."""
-    name = '_' + attr
-    @property
-    def prop(self):
-        """Get the specific attribute."""
-        return getattr(self, name)
-    @prop.setter
-    def prop(self, value):
-        """Set the attribute."""
-        setattr(self, name, value)
-        if isa(self, Pair):
-            self.update_str()
-    return prop
+_gensyms = itertools.count(1)
+
+def gensym(name):
+    """Make a fresh symbol named after name, which the reader can't produce."""
+    # tokens never contain ';', so no name in source can capture it
+    return Symbol('{0};{1}'.format(name, next(_gensyms)))
+
+class Char(str):
+    """Class for character."""
+    pass
+
+_char_names = {
+        'space':' ', 'newline':'\n', 'tab':'\t', 'nul':'\0', 'null':'\0',
+        'return':'\r', 'alarm':'\a', 'backspace':'\b', 'delete':'\x7f',
+        'escape':'\x1b',
+}
+
+_char_tokens = {_char_names[i]:i for i in _char_names if i != 'null'}
+
+def str2char(name):
+    """Convert name of a character after #\\ into the character."""
+    if len(name) == 1:
+        return Char(name)
+    if name.lower() in _char_names:
+        return Char(_char_names[name.lower()])
+    if name[0] in 'xX':
+        try:
+            return Char(chr(int(name[1:], 16)))
+        except ValueError:
+            pass
+    raise SyntaxError('unknown character #\\'+name)
+
+def do_quote(parts):
+    """Return pair or list if possible when returning from quote."""
+    if not isa(parts, list) or not parts:
+        return parts
+    if parts.count('.')>1 or parts.count('.')==1 and parts.index('.')<len(parts)-2:
+        require(parts, False, 'ill-formed dotted list')
+    if len(parts) >= 3 and parts[-2] == '.':
+        return seq2list([do_quote(i) for i in parts[:-2]], do_quote(parts[-1]))
+    return seq2list([do_quote(i) for i in parts])
+
+class TailCall:
+    """Procedure call left pending by an expression in tail position."""
+    __slots__ = ('func', 'args')
+    def __init__(self, func, args):
+        """Record the procedure and its evaluated arguments."""
+        self.func = func
+        self.args = args
+
+# called for every call made through call_primitive and apply_procedure,
+# and by the evaluators for calls and loops they run themselves, while
+# evaluations have limits of fuel; read it from this module, as it changes
+step_hook = None
+
+def call_primitive(func, args, env):
+    """Call a primitive procedure with evaluated arguments."""
+    if step_hook is not None:
+        step_hook()
+    if isa(func, Primitive):
+        return func.apply(args, env)
+    return func(*args)
+
+def apply_procedure(func, args, env):
+    """Apply func to args, running tail calls in a loop instead of recursing."""
+    while True:
+        if not isa(func, Procedure):
+            return call_primitive(func, args, env)
+        if step_hook is not None:
+            step_hook()
+        scope = func.scope
+        if scope.arity != len(args):
+            args = func.collect_args(args)
+        if scope.padding:
+            args.extend(scope.padding)
+        result = func.body(Frame(args, func.env, scope))
+        if type(result) is not TailCall:
+            return result
+        func, args = result.func, result.args
+
+def scan_defines(parts, names=None):
+    """Collect names defined in parts, not looking into nested lambdas."""
+    if names is None:
+        names = []
+    if isa(parts, list) and parts:
+        if parts[0] == 'quote' or parts[0] == 'lambda':
+            return names
+        if parts[0] == 'define':
+            names.append(parts[1])
+        for i in parts:
+            scan_defines(i, names)
+    return names
+
+def resolve(symbol, scope):
+    """Return (depth, index) of symbol bound in local scopes or None if it's global."""
+    depth = 0
+    while isa(scope, Scope):
+        if symbol in scope.index:
+            return depth, scope.index[symbol]
+        scope = scope.outer
+        depth += 1
+    return None
+
+def root_env(scope):
+    """Return the global environment at the root of scope."""
+    while isa(scope, Scope):
+        scope = scope.outer
+    return scope
+
+def lookup_unresolved(env, symbol, genv):
+    """Look up symbol missing from genv, which eval may have defined in a frame of env.
+
+    Such names weren't scanned when the body around eval was analyzed, so
+    they're only found here, after the global lookup fails.
+    """
+    while isa(env, Frame):
+        i = env.scope.index.get(symbol)
+        if i is not None and i < len(env.vars) and env.vars[i] is not UNASSIGNED:
+            return env.vars[i]
+        env = env.outer
+    return genv.find(symbol)[symbol]
+
+def frame_at(env, depth):
+    """Return the frame depth levels outside env."""
+    for _ in range(depth):
+        env = env.outer
+    return env
+
+class _Spine:
+    """Pairs of a proper list from its last one, valid until cdr of one of them is set.
+
+    A spine copied from the bottom of another, when a list branches off a
+    tail which isn't the top of its spine, is only valid as long as that
+    one is alive and valid too.
+    """
+    __slots__ = ('valid', 'pairs', 'parent', '__weakref__')
+    def __init__(self, pairs, parent=None):
+        """Record pairs of the list, last first."""
+        self.valid = True
+        self.pairs = pairs
+        self.parent = parent
+    def is_valid(self):
+        """Judge whether no cdr of its pairs has been set."""
+        spine = self
+        while spine.valid:
+            if spine.parent is None:
+                return True
+            spine = spine.parent()
+            if spine is None:
+                return False
+        return False
 
 class Pair:
-    """Class for pair in scheme(created by function cons)."""
-    car = _property('car')
-    cdr = _property('cdr')
+    """Class for pair in scheme(created by function cons).
+
+    A list is a chain of pairs linked by cdr and ending with '(). A spine of
+    its pairs, from the last one, is kept by the first one once its length
+    or members by index are needed, and every pair refers weakly to the one
+    spine it's in with its position from the end. A pair consed onto the
+    first one of a spine is added to it, so lists grown by cons cost
+    constant time for every pair, and the cdr of a list uses the cached
+    length while the list lives, but doesn't keep the pairs before it alive.
+    """
+    __slots__ = ('car', 'cdr', '_spine', '_member')
     def __init__(self, car, cdr):
         """Construct a pair with given data."""
-        # be the cache for string form of this pair
-        self._str = ''
-        # here can't use prop to update _str
-        # because _car and _cdr aren't constructed
-        self._car = car
-        self._cdr = cdr
-        # invoke update_str() manually only here
-        self.update_str()
-    def _rm_outer(self, symbol):
-        """Remove outer boundary of second part when printing."""
-        if isa(symbol, Pair) or isa(symbol, List):
-            return ' ' + str(symbol)[1:-1]
-        # deal with situation where cdr is '()
-        if self.cdr == []:
-            return ''
-        return ' . ' + tostr(symbol)
-    def update_str(self):
-        """Format for printing."""
-        self._str = ''.join(['(',tostr(self.car),self._rm_outer(self.cdr),')'])
+        self.car = car
+        self.cdr = cdr
     def __str__(self):
         """Return string form."""
-        return self._str
-    def __eq__(self, pair):
-        """Compare two pairs."""
-        if isa(pair, list) and pair == []:
-            return False
-        require_type(isa(pair, Pair), "the two type can't be compared")
-        return self.car == pair.car and self.cdr == pair.cdr
-
-class List:
-    """Class for list."""
-    def __init__(self, members):
-        """Construct a list in scheme with members in a list."""
-        require_type(isa(members, list),
-                'the parameter of list must be a list of objects')
-        self.members = members
-        self.pair = self._list(members)
-    def _list(self, exprs):
-        """Construct a list with method cons."""
-        require(exprs, len(exprs)!=0)
-        result = Pair(exprs[-1], [])
-        for i in reversed(exprs[:-1]):
-            result = Pair(i, result)
-        return result
-    def __str__(self):
-        """Format for printing."""
-        return str(self.pair)
+        return tostr(self)
+    def __getstate__(self):
+        """Pickle the pair without its spine, which is only valid in this process."""
+        return None, {'car': self.car, 'cdr': self.cdr}
+    def __bool__(self):
+        """A pair is always true."""
+        return True
+    def __iter__(self):
+        """Iterate over members of the list starting from this pair."""
+        pair = self
+        while isa(pair, Pair):
+            yield pair.car
+            pair = pair.cdr
+    def _pairs(self):
+        """Return pairs of the list, last first, and position of this one."""
+        spine, index = _valid_member(self)
+        if spine is not None:
+            return spine.pairs, index
+        # pairs down to one in a valid spine, or to the end
+        walked = []
+        pair = self
+        while isa(pair, Pair):
+            spine, index = _valid_member(pair)
+            if spine is not None:
+                break
+            walked.append(pair)
+            pair = pair.cdr
+        else:
+            require_type(is_null(pair), 'the parameter must be a proper list')
+        if spine is None:
+            spine = _Spine([])
+        elif index == len(spine.pairs) - 1:
+            # consed onto the first pair of the spine, which passes it on
+            pair._spine = None
+        else:
+            spine = _Spine(spine.pairs[:index+1], weakref.ref(spine))
+        pairs = spine.pairs
+        ref = weakref.ref(spine)
+        for pair in reversed(walked):
+            pair._member = (ref, len(pairs))
+            pairs.append(pair)
+        self._spine = spine
+        return pairs, len(pairs) - 1
     def __len__(self):
         """Length of list."""
-        return len(self.members)
-    def __eq__(self, s_list):
-        """Compare two lists."""
-        if isa(s_list, list) and s_list == []:
-            return self.members == []
-        require_type(isa(s_list, List), "the two type can't be compared")
-        return self.pair == s_list.pair
+        pairs, index = self._pairs()
+        return index + 1
+    def _nth(self, i):
+        """Return the pair whose car is the ith member."""
+        pairs, index = self._pairs()
+        if i < 0 or i > index:
+            raise IndexError('list index out of range')
+        return pairs[index-i]
     def __getitem__(self, i):
         """Get member by index."""
-        return self.members[i]
-    def __setitem__(self, key, val):
+        return self._nth(i).car
+    def __setitem__(self, i, val):
         """Set member by index."""
-        self.members[key] = val
-        pair = self.pair
-        for i in range(key):
-            pair = pair.cdr
-        pair.car = val
-    def __add__(self, right):
-        """Add scheme list with another thing."""
-        try:
-            if right == []:
-                return self
-        except TypeError:
-            None
-        raise TypeError("+ can't be applied between list and "+str(type(right)))
-    @property
-    def car(self):
-        """Return the first part."""
-        return self.pair.car
-    @property
-    def cdr(self):
-        """Return the second part."""
-        return self.pair.cdr
-    @car.setter
-    def car(self, value):
-        """Set the first element."""
-        self.pair.car = value
-    @cdr.setter
-    def cdr(self, value):
-        """Set the second element."""
-        self.pair.cdr = value
+        self._nth(i).car = val
+    def __eq__(self, pair):
+        """Compare two pairs."""
+        if not isa(pair, Pair):
+            return False
+        left = self
+        while isa(left, Pair) and isa(pair, Pair):
+            if left is pair:
+                return True
+            if not left.car == pair.car:
+                return False
+            left, pair = left.cdr, pair.cdr
+        return left == pair
+
+def _valid_member(pair):
+    """Get the spine a pair is in and its position, or None if it's not in a valid one."""
+    member = getattr(pair, '_member', None)
+    if member is not None:
+        spine = member[0]()
+        if spine is not None and spine.is_valid():
+            return spine, member[1]
+    return None, None
 
 class Promise:
-    """Class for lazy binding."""
-    def __init__(self, exprs):
-        """Construct a promise with its content."""
-        self.exprs = exprs
+    """Class for lazy binding.
+
+    The thunk is dropped once it's forced, so that a forced stream doesn't
+    keep what its thunk refers to.
+    """
+    __slots__ = ('thunk', 'forced', 'value')
+    def __init__(self, thunk):
+        """Construct a promise of the result of calling thunk."""
+        self.thunk = thunk
+        self.forced = False
+        self.value = None
+    def __str__(self):
+        """Return string form."""
+        return '#<promise>'
 
-def _pair2list(pair):
-    """Convert a pair to list."""
+def force(promise, env):
+    """Get the value of the promise, calling its thunk the first time."""
+    require_type(isa(promise,Promise), 'parameter of force must be a promise')
+    if promise.forced:
+        return promise.value
+    value = apply_procedure(promise.thunk, [], env)
+    # the thunk may have forced the promise itself
+    if not promise.forced:
+        promise.value = value
+        promise.forced = True
+        promise.thunk = None
+    return promise.value
+
+def make_promise(value):
+    """Construct a promise forced with value, or return value if it's a promise."""
+    if isa(value, Promise):
+        return value
+    promise = Promise(None)
+    promise.value = value
+    promise.forced = True
+    return promise
+
+def seq2list(members, tail=None):
+    """Construct a scheme list with members in a python sequence.
+
+    If tail is given, it replaces '() at the end of the list.
+    """
+    result = [] if tail is None else tail
+    for i in reversed(members):
+        result = Pair(i, result)
+    return result
+
+def list2seq(s_list):
+    """Return members of a scheme list in a python list."""
+    require_type(is_list(s_list), 'the parameter must be a list')
     members = []
-    while pair:
-        members.append(pair.car)
-        pair = pair.cdr
-    return List(members)
+    while isa(s_list, Pair):
+        members.append(s_list.car)
+        s_list = s_list.cdr
+    return members
 
-def _list2pair(s_list):
-    """Convert a list into pair."""
-    return s_list.pair
+def is_null(obj):
+    """Judge whether obj is '()."""
+    return isa(obj, list) and not obj
 
 def append(*values):
-    """Append val to a list, not modifying the list."""
-    require(values, len(values)>=2)
-    values = list(values)
-    s_list = values[0]
-    appended = values[1:]
-    require_type(isa(s_list,List), 'the first parameter of append must be a list')
-    last = appended.pop()
-    members = s_list.members + appended
-    result = Pair(members[-1], last)
-    for i in reversed(members[:-1]):
-        result = Pair(i, result)
-    if _can_be_list(result):
-        return _pair2list(result)
+    """Append lists, sharing the last one instead of copying it."""
+    if not values:
+        return []
+    require_type(all(is_list(i) for i in values[:-1]),
+            'parameters of append except the last one must be lists')
+    result = values[-1]
+    for s_list in reversed(values[:-1]):
+        result = seq2list(list2seq(s_list), result)
     return result
 
 def do_is(op_left, op_right):
@@ -190,7 +537,11 @@ def do_is(op_left, op_right):
     return op_left is op_right
 
 def do_sqrt(num):
-    """Compute square root of the number."""
+    """Compute square root of the number, exactly for perfect squares."""
+    if type(num) is int and num >= 0:
+        root = math.isqrt(num)
+        if root * root == num:
+            return root
     if num < 0:
         from cmath import sqrt
         return sqrt(num)
@@ -198,44 +549,41 @@ def do_sqrt(num):
     return sqrt(num)
 
 def is_list(s_list):
-    """Judge whether it's a list."""
-    return isa(s_list, List)
+    """Judge whether it's a proper list."""
+    # the fast one moves two steps each time to catch circular lists
+    slow = fast = s_list
+    while isa(fast, Pair):
+        fast = fast.cdr
+        if not isa(fast, Pair):
+            break
+        fast = fast.cdr
+        slow = slow.cdr
+        if fast is slow:
+            return False
+    return is_null(fast)
 
 def is_pair(pair):
     """Judge whether it's a pair."""
-    return isa(pair, Pair) or is_list(pair)
-
-def _can_be_list(pair):
-    """Judge whether a pair can be converted into a list."""
-    assert(isa(pair, Pair))
-    return str(pair).find(' . ') < 0
-
-def _should_be_pair(s_list):
-    """Judge whether a list should be a pair."""
-    assert(isa(s_list, List))
-    return str(s_list).find(' . ') > 0
+    return isa(pair, Pair)
 
 def cons(first, second):
-    """Construct a pair or a list if possible."""
-    pair = Pair(first, second)
-    if _can_be_list(pair):
-        pair = _pair2list(pair)
-    return pair
+    """Construct a pair."""
+    return Pair(first, second)
 
 def list_ref(s_list, i):
     """Return the ith element of the list."""
-    require_type(isa(s_list,List), 'parameters of list-ref must be a list')
+    require_type(isa(s_list,Pair), 'parameters of list-ref must be a list')
     return s_list[i]
 
 def list_set(s_list, i, val):
     """Set value in list by index."""
-    require_type(isa(s_list,List), 'parameters of list-set! must be a list')
+    require_type(isa(s_list,Pair), 'parameters of list-set! must be a list')
     s_list[i] = val
     return None
 
 def make_list(num, val):
     """Construct a list filled with num numbers of value val."""
-    return List([val for i in range(num)])
+    return seq2list([val for i in range(num)])
 
 def set_car(pair, val):
     """Set car of the pair."""
@@ -243,20 +591,124 @@ def set_car(pair, val):
     return pair
 
 def set_cdr(pair, val):
-    """Set cdr of the pair."""
+    """Set cdr of the pair, invalidating the spine of lists it's in."""
     pair.cdr = val
-    if isa(pair, Pair) and _can_be_list(pair):
-        return _pair2list(pair)
-    if isa(pair, List) and _should_be_pair(pair):
-        return _list2pair(pair)
+    member = getattr(pair, '_member', None)
+    if member is not None:
+        spine = member[0]()
+        if spine is not None:
+            spine.valid = False
+        pair._member = None
     return pair
 
 def get_cdr(pair):
     """Get cdr of a pair or list."""
-    result = pair.cdr
-    if isa(result, Pair) and _can_be_list(result):
-        return _pair2list(result)
-    return result
+    return pair.cdr
+
+def _vector_storage(items):
+    """Store items in an array if they're all fixnums or all flonums, else in a list."""
+    items = list(items)
+    if items and type(items[0]) is float and all(type(i) is float for i in items):
+        return array.array('d', items)
+    if items and type(items[0]) is int and all(type(i) is int for i in items):
+        try:
+            return array.array('q', items)
+        except OverflowError:
+            # bignums
+            pass
+    return items
+
+class Vector:
+    """Class for vector.
+
+    Members are stored in an array.array while they're all fixnums or all
+    flonums, and in a list once any other value is set.
+    """
+    __slots__ = ('items',)
+    def __init__(self, items=()):
+        """Construct a vector with given members."""
+        self.items = _vector_storage(items)
+    def __str__(self):
+        """Return string form."""
+        return tostr(self)
+    def __len__(self):
+        """Get length of the vector."""
+        return len(self.items)
+    def __iter__(self):
+        """Iterate over members."""
+        return iter(self.items)
+    def _check_index(self, i):
+        """Complain about an index out of range."""
+        if not is_int(i) or i < 0 or i >= len(self.items):
+            raise IndexError('vector index out of range')
+    def __getitem__(self, i):
+        """Get member by index."""
+        self._check_index(i)
+        return self.items[i]
+    def __setitem__(self, i, val):
+        """Set member by index, leaving the array if val doesn't fit it."""
+        self._check_index(i)
+        items = self.items
+        if type(items) is array.array:
+            try:
+                if type(val) is (float if items.typecode == 'd' else int):
+                    items[i] = val
+                    return
+            except OverflowError:
+                pass
+            items = self.items = list(items)
+        items[i] = val
+    def __eq__(self, vector):
+        """Compare two vectors."""
+        return isa(vector, Vector) and len(self.items) == len(vector.items) \
+                and all(i == j for i, j in zip(self.items, vector.items))
+
+def is_vector(vector):
+    """Judge whether it's a vector."""
+    return isa(vector, Vector)
+
+def make_vector(num, val=0):
+    """Construct a vector filled with num numbers of value val."""
+    require_type(is_int(num) and num >= 0, 'length of vector must be a natural number')
+    vector = Vector([val])
+    if type(vector.items) is array.array:
+        vector.items *= num
+    else:
+        vector.items = [val] * num
+    return vector
+
+def vector_ref(vector, i):
+    """Return the ith element of the vector."""
+    require_type(isa(vector,Vector), 'parameters of vector-ref must be a vector')
+    return vector[i]
+
+def vector_set(vector, i, val):
+    """Set value in vector by index."""
+    require_type(isa(vector,Vector), 'parameters of vector-set! must be a vector')
+    vector[i] = val
+    return None
+
+def vector_length(vector):
+    """Get length of the vector."""
+    require_type(isa(vector,Vector), 'parameters of vector-length must be a vector')
+    return len(vector.items)
+
+def vector2list(vector):
+    """Convert a vector into a scheme list."""
+    require_type(isa(vector,Vector), 'parameters of vector->list must be a vector')
+    return seq2list(list(vector.items))
+
+def list2vector(s_list):
+    """Convert a scheme list into a vector."""
+    require_type(is_list(s_list), 'parameters of list->vector must be a list')
+    return Vector(s_list or ())
+
+def vector_fill(vector, val):
+    """Fill the vector with val."""
+    require_type(isa(vector,Vector), 'parameters of vector-fill! must be a vector')
+    filled = make_vector(len(vector.items), val)
+    vector.items = filled.items
+    return None
 
 isa = isinstance
 
@@ -268,6 +720,8 @@ def transform(token):
         return False
     if token[0] == '"':
         return bytes(token[1:-1], "utf-8").decode('unicode-escape')
+    if token.startswith('#\\'):
+        return str2char(token[2:])
     if token.startswith(';'):
         return ';'
     if token.startswith('#b'):
@@ -292,10 +746,43 @@ def transform(token):
                 return result
             except ValueError:
                 try:
-                    return fractions.Fraction(token)
+                    return exact(fractions.Fraction(token))
                 except ValueError:
                     return Symbol(token.lower())
 
+_quotes = {
+        "'":'quote', '`':'quasiquote', ',':'unquote', ',@':'unquote-splicing',
+}
+
+quotes = {s:Symbol(_quotes[s]) for s in _quotes}
+
+def read_parts(tokenizer):
+    """Read tokens of a statement into parts, or return None at the end of file."""
+    def _read_ahead(token):
+        """Read ahead to construct an operation."""
+        if token is None:
+            raise tokenizer.error('unexpected end of file')
+        if token in quotes:
+            return [quotes[token], _read_ahead(tokenizer.next_token())]
+        if token == '(' or token == '#(':
+            members = []
+            while True:
+                next_token = tokenizer.next_token()
+                if next_token == ')':
+                    break
+                members.append(_read_ahead(next_token))
+            if token == '#(':
+                # vectors evaluate to themselves
+                return Vector([do_quote(i) for i in members])
+            return members
+        else:
+            return transform(token)
+    # body of parse
+    token = tokenizer.next_token()
+    if token is None:
+        return None
+    return _read_ahead(token)
+
 def tostr(token):
     """Convert a token into form in lisp."""
     if token is True:
@@ -304,6 +791,8 @@ def tostr(token):
         return '#f'
     if isa(token, Symbol):
         return token
+    if isa(token, Char):
+        return '#\\' + _char_tokens.get(token, token)
     if isa(token, str):
         import json
         return json.dumps(token)
@@ -314,6 +803,17 @@ def tostr(token):
         return result[1:-1]
     if isa(token, list):
         return '(' + ' '.join(map(tostr, token)) + ')'
+    if isa(token, Vector):
+        return '#(' + ' '.join(map(tostr, token.items)) + ')'
+    if isa(token, Pair):
+        result = []
+        while isa(token, Pair):
+            result.append(tostr(token.car))
+            token = token.cdr
+        if not is_null(token):
+            result.append('.')
+            result.append(tostr(token))
+        return '(' + ' '.join(result) + ')'
     return str(token)
 
 def require(var, condition, msg='wrong length'):
@@ -360,7 +860,8 @@ def str2num(numstr):
 
 def quotient(left_object, right_object):
     """Return quotient of the two and round towards 0."""
-    return int(float(left_object)/right_object)
+    result = abs(left_object) // abs(right_object)
+    return result if (left_object < 0) == (right_object < 0) else -result
 
 def remainder(left_object, right_object):
     """Return left % right whose sign is the same with the left one."""
@@ -369,13 +870,109 @@ def remainder(left_object, right_object):
         result = result - right_object
     return result
 
-def display(content):
-    """Print content."""
-    print(content if isa(content, str) else tostr(content))
-
 def lcm(num1, num2):
     """Compute the least common multiple for two numbers."""
-    return num1 * num2 // fractions.gcd(num1,num2)
+    if num1 == 0 or num2 == 0:
+        return 0
+    return abs(num1 * num2) // math.gcd(num1,num2)
+
+class Rational(fractions.Fraction):
+    """Exact fraction whose results are integers when they're whole numbers.
+
+    Arithmetic of integers and floats never meets it, so their operators
+    stay as fast as python's.
+    """
+    __slots__ = ()
+
+def exact(num):
+    """Turn an exact fraction into an integer if it's whole, else into a Rational."""
+    if not isa(num, fractions.Fraction):
+        return num
+    if num.denominator == 1:
+        return num.numerator
+    if type(num) is not Rational:
+        # it's reduced already, so don't compute gcd of large numbers again
+        num.__class__ = Rational
+    return num
+
+def _exact_method(name):
+    """Make a method of Rational returning exact results of the one of Fraction."""
+    method = getattr(fractions.Fraction, name)
+    @functools.wraps(method)
+    def exact_method(*args):
+        num = method(*args)
+        if type(num) is fractions.Fraction:
+            if num.denominator == 1:
+                return num.numerator
+            num.__class__ = Rational
+        return num
+    return exact_method
+
+for _name in ('__add__', '__radd__', '__sub__', '__rsub__', '__mul__', '__rmul__',
+        '__truediv__', '__rtruediv__', '__mod__', '__rmod__', '__pow__', '__rpow__',
+        '__neg__', '__pos__', '__abs__'):
+    setattr(Rational, _name, _exact_method(_name))
+
+def add(*nums):
+    """Add numbers."""
+    return sum(nums)
+
+def sub(*nums):
+    """Subtract the rest numbers from the first one, or negate it."""
+    result = nums[0]
+    if len(nums) == 1:
+        return -result
+    for i in nums[1:]:
+        result -= i
+    return result
+
+def mul(*nums):
+    """Multiply numbers."""
+    return math.prod(nums)
+
+def div2(molecular, denominator):
+    """Divide two numbers, keeping the result exact if possible."""
+    if type(molecular) is int and type(denominator) is int:
+        if denominator and molecular % denominator == 0:
+            return molecular // denominator
+        return Rational(molecular, denominator)
+    try:
+        return exact(fractions.Fraction(molecular, denominator))
+    except TypeError:
+        # when molecular or denominator is a float
+        return molecular / denominator
+
+def div(*nums):
+    """Divide the first number by the rest ones, or get its reciprocal."""
+    if len(nums) == 1:
+        return div2(1, nums[0])
+    return div2(nums[0], mul(*nums[1:]))
+
+def expt(base, power):
+    """Raise base to power, exactly if base is exact and power is an integer."""
+    if type(power) is int and (type(base) is int or isa(base, fractions.Fraction)):
+        if power < 0:
+            return exact(fractions.Fraction(base) ** power)
+        return exact(base ** power)
+    return math.pow(base, power)
+
+def gcd(*nums):
+    """Compute the greatest common divisor of integers."""
+    return functools.reduce(math.gcd, nums, 0)
+
+def lcm_all(*nums):
+    """Compute the least common multiple of integers."""
+    return functools.reduce(lcm, nums, 1)
+
+def chain_cmp(func):
+    """Make a comparison holding for every two adjacent arguments."""
+    def compare(*nums):
+        """Compare numbers in order."""
+        for i in range(len(nums)-1):
+            if not func(nums[i], nums[i+1]):
+                return False
+        return True
+    return compare
 
 def numerator(num):
     """Return numerator of a fraction."""
@@ -423,59 +1020,58 @@ def append_str(*strs):
 
 def reverse_list(s_list):
     """Reverse a scheme list."""
-    require_type(isa(s_list, List), 'parameter of reverse must be a list')
-    new_list = s_list.members.copy()
-    new_list.reverse()
-    return List(new_list)
+    require_type(is_list(s_list), 'parameter of reverse must be a list')
+    result = []
+    for i in s_list or ():
+        result = Pair(i, result)
+    return result
 
-def is_procedure(procedure):
-    """Judge whether it's a procedure."""
-    return isa(procedure,Procedure) or isa(procedure,type(max)) or isa(procedure,type(tostr))
+def is_eqv(left, right):
+    """Judge whether two objects are the same by eqv?.
 
-def is_input(port):
-    """Judge whether the port is an input port."""
-    try:
-        return port.mode == 'r'
-    except Exception:
+    Symbols, characters and numbers are values in python, so eq? is the
+    same as eqv?.
+    """
+    if left is right:
+        return True
+    if type(left) is not type(right):
+        # a symbol and a string, or an exact number and an inexact one
         return False
+    if isa(left, (Symbol, Char, int, float, fractions.Fraction, complex)):
+        return left == right
+    return is_null(left) and is_null(right)
 
-def is_output(port):
-    """Judge whether the port is an output port."""
-    try:
-        return port.mode == 'w'
-    except Exception:
+def is_equal(left, right):
+    """Judge whether two objects print the same, comparing structures by equal?."""
+    while isa(left, Pair) and isa(right, Pair):
+        if left is right:
+            return True
+        if not is_equal(left.car, right.car):
+            return False
+        left, right = left.cdr, right.cdr
+    if type(left) is not type(right):
         return False
+    if isa(left, Vector):
+        return len(left.items) == len(right.items) and all(map(is_equal, left.items, right.items))
+    return left == right
+
+def is_procedure(procedure):
+    """Judge whether it's a procedure."""
+    return isa(procedure,Procedure) or isa(procedure,Primitive) \
+            or isa(procedure,type(max)) or isa(procedure,type(tostr))
 
-def read(in_file):
-    """Read a line from the file."""
-    require_type(is_input(in_file), 'the parameter of read must be an input file')
-    txt = in_file.readline().lower()
-    while txt == '\n':
-        txt = in_file.readline().lower()
-    return txt.strip() if txt else Symbol('#!eof')
+def spread_args(args):
+    """Check arguments of apply, returning the procedure and arguments with the last list spread."""
+    require(args, len(args)>1)
+    require_type(is_list(args[-1]), 'the last parameter of apply must be a list')
+    require_type(is_procedure(args[0]),
+            'the first parameter of apply must be a procedure')
+    return args[0], args[1:-1] + list2seq(args[-1])
 
 def is_eof(eof):
     """Judge whether it's an eof."""
     return eof == Symbol('#!eof')
 
-def close_input(in_file):
-    """Close input file."""
-    require_type(is_input(in_file), 'the parameter must be an input file')
-    in_file.close()
-
-def write(content, port=sys.stdout):
-    """Write content to the port."""
-    require_type(is_output(port), 'the parameter of write must be an output file')
-    if port is sys.stdout:
-        display(content)
-        return
-    port.write(tostr(content))
-
-def close_output(out_file):
-    """Close the output file."""
-    require_type(is_output(out_file), 'the parameter must be an output file')
-    out_file.close()
-
 def s_or(*args):
     """Logical or."""
     result = False
@@ -498,13 +1094,13 @@ def promise_forced(promise):
     """Judge whether the promise has been forced."""
     require_type(isa(promise,Promise),
             'the parameter of promise_forced must be a Promise')
-    return promise.exprs.env.find(Symbol('already-run?'))['already-run?']
+    return promise.forced
 
 def promise_value(promise):
     """Return forced value in promise else raise exception."""
     require_type(isa(promise,Promise),
             'the parameter of promise_forced must be a Promise')
-    if promise_forced(promise):
-        return promise.exprs.env.find(Symbol('result'))['result']
+    if promise.forced:
+        return promise.value
     raise RuntimeError('the promise has not been forced')
 
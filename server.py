@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+"""Server running repl sessions for clients of a socket with asyncio.
+
+The event loop only moves text. Every session reads and evaluates in a
+thread of its own, so a long evaluation doesn't hold up other clients,
+and what it prints is sent back to its client alone.
+"""
+
+import asyncio
+import contextvars
+import os
+import queue
+import stat
+import sys
+import threading
+
+# bytes waiting to be sent to a client, past which its session waits for them
+_HIGH_WATER = 1 << 16
+
+class _Lines:
+    """Text file of lines received from a client, read in a session thread."""
+    def __init__(self):
+        """Start with nothing received."""
+        self.lines = queue.Queue()
+    def put(self, line):
+        """Add a line received, or '' at the end."""
+        self.lines.put(line)
+    def isatty(self):
+        """Let tokenizers read a line at a time, evaluating what's complete."""
+        return True
+    def readline(self):
+        """Wait for the next line, returning '' at the end."""
+        line = self.lines.get()
+        if not line:
+            # for readers after this one
+            self.lines.put(line)
+        return line
+    def read(self, size=-1):
+        """Read like readline."""
+        return self.readline()
+
+class _Client:
+    """Text file writing to a client from a session thread.
+
+    The session waits for text to drain once too much of it is waiting,
+    so that a client reading slowly slows it down instead of filling memory.
+    """
+    def __init__(self, loop, writer):
+        """Write through writer of the loop."""
+        self.loop = loop
+        self.writer = writer
+    def write(self, text):
+        """Send text to the client."""
+        writer = self.writer
+        if writer.is_closing():
+            return len(text)
+        self.loop.call_soon_threadsafe(writer.write, text.encode('utf-8'))
+        if writer.transport.get_write_buffer_size() > _HIGH_WATER:
+            try:
+                asyncio.run_coroutine_threadsafe(writer.drain(), self.loop).result()
+            except ConnectionError:
+                pass
+        return len(text)
+    def flush(self):
+        """Do nothing, since text is sent when written."""
+        pass
+
+class _SessionOutput:
+    """Replacement of sys.stdout writing to the client of the current session.
+
+    The client is kept in a context variable, so threads given the context
+    of a session, like those of its futures, write to it too.
+    """
+    def __init__(self, default):
+        """Write to default in threads which aren't sessions."""
+        self.default = default
+        self.stream = contextvars.ContextVar('stream', default=None)
+    def _stream(self):
+        """Get the stream of the current context."""
+        return self.stream.get() or self.default
+    def write(self, text):
+        """Write text."""
+        return self._stream().write(text)
+    def flush(self):
+        """Flush the stream."""
+        self._stream().flush()
+    def __getattr__(self, name):
+        """Get other attributes of the default stream."""
+        return getattr(self.default, name)
+
+def _run_session(session, lines, client, output):
+    """Run a session in the current thread with its output sent to the client."""
+    token = output.stream.set(client)
+    try:
+        session(lines)
+    finally:
+        output.stream.reset(token)
+
+async def _handle(session, output, reader, writer):
+    """Serve a client, feeding its lines to a session running in a thread."""
+    loop = asyncio.get_running_loop()
+    lines = _Lines()
+    done = loop.create_future()
+    def run():
+        try:
+            _run_session(session, lines, _Client(loop, writer), output)
+        finally:
+            loop.call_soon_threadsafe(done.set_result, None)
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            lines.put(line.decode('utf-8', 'replace'))
+    except ConnectionError:
+        pass
+    finally:
+        lines.put('')
+    await done
+    try:
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+    except ConnectionError:
+        pass
+
+async def _serve(address, session, output):
+    """Accept clients at address forever."""
+    handle = lambda reader, writer: _handle(session, output, reader, writer)
+    if address.isdigit():
+        server = await asyncio.start_server(handle, '127.0.0.1', int(address))
+    else:
+        server = await asyncio.start_unix_server(handle, address)
+    sys.stderr.write('serving on {0}\n'.format(address))
+    sys.stderr.flush()
+    async with server:
+        await server.serve_forever()
+
+def _remove_stale_socket(path):
+    """Remove a socket left at path by a server before, refusing to remove anything else."""
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError('{0} exists and is not a socket'.format(path))
+    os.unlink(path)
+
+def serve(address, session):
+    """Serve clients at a port of localhost or a unix socket path.
+
+    session is called with a text file of lines from a client in a thread
+    of its own, and what it prints goes to the client. A socket at the path
+    is replaced, but OSError is raised if something else is there.
+    """
+    if not address.isdigit():
+        _remove_stale_socket(address)
+    output = sys.stdout = _SessionOutput(sys.stdout)
+    try:
+        asyncio.run(_serve(address, session, output))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stdout = output.default
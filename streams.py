@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+"""Lazy streams of SRFI-41 made of pairs whose cdrs are promises.
+
+Operations walk streams in loops instead of recursing, and thunks of the
+streams they make are partials of functions here, so that images can save
+streams not forced yet. Those consuming a stream get their list of
+arguments and clear it, so that members they've passed can be freed and a
+stream longer than memory can be consumed.
+"""
+
+import functools
+
+from scheme_types import *
+import ports
+
+def _lazy(func, *args):
+    """Construct a promise of calling func with args."""
+    return Promise(functools.partial(func, *args))
+
+def is_stream_pair(stream):
+    """Judge whether it's a pair of a stream."""
+    return isa(stream, Pair) and isa(stream.cdr, Promise)
+
+def is_stream(stream):
+    """Judge whether it's an empty stream or a pair of a stream."""
+    return is_null(stream) or is_stream_pair(stream)
+
+def _require_stream(stream, name):
+    """Complain if it isn't a stream."""
+    require_type(is_stream(stream), 'the stream parameter of {0} must be a stream'.format(name))
+
+def _require_streams(streams, name):
+    """Complain if any of them isn't a stream, without keeping one in a variable."""
+    for i in streams:
+        _require_stream(i, name)
+
+def stream_car(stream):
+    """Get the first member of the stream."""
+    require_type(is_stream_pair(stream), 'the parameter of stream-car must be a stream pair')
+    return stream.car
+
+def stream_cdr(stream, env):
+    """Get the rest of the stream, forcing it."""
+    require_type(is_stream_pair(stream), 'the parameter of stream-cdr must be a stream pair')
+    return force(stream.cdr, env)
+
+def list2stream(s_list):
+    """Convert a scheme list into a stream."""
+    require_type(is_list(s_list), 'the parameter of list->stream must be a list')
+    result = []
+    for i in reversed(list2seq(s_list)):
+        result = Pair(i, make_promise(result))
+    return result
+
+def stream2list(args):
+    """Convert the first num members of the stream, or all of them, into a scheme list."""
+    env = args.pop()
+    num, stream = args if len(args) == 2 else (None, args[0])
+    args.clear()
+    _require_stream(stream, 'stream->list')
+    result = []
+    while isa(stream, Pair) and (num is None or len(result) < num):
+        result.append(stream.car)
+        stream = force(stream.cdr, env)
+    return seq2list(result)
+
+def _take(num, stream, env):
+    """Make a stream of the first num members of the stream."""
+    if num <= 0 or not isa(stream, Pair):
+        return []
+    if num == 1:
+        return Pair(stream.car, make_promise([]))
+    return Pair(stream.car, _lazy(_take_rest, num-1, stream, env))
+
+def _take_rest(num, stream, env):
+    """Take num members of the rest of the stream."""
+    return _take(num, force(stream.cdr, env), env)
+
+def stream_take(num, stream, env):
+    """Make a stream of the first num members of the stream."""
+    require_type(is_int(num) and num >= 0, 'the count of stream-take must be a natural number')
+    _require_stream(stream, 'stream-take')
+    return _take(num, stream, env)
+
+def _drop(args, name):
+    """Get the stream without its first num members, given args of stream-drop."""
+    num, stream, env = args
+    args.clear()
+    require_type(is_int(num) and num >= 0,
+            'the count of {0} must be a natural number'.format(name))
+    _require_stream(stream, name)
+    while num > 0 and isa(stream, Pair):
+        stream = force(stream.cdr, env)
+        num -= 1
+    return stream
+
+def stream_drop(args):
+    """Get the stream without its first num members."""
+    return _drop(args, 'stream-drop')
+
+def stream_ref(args):
+    """Get the member of the stream by index."""
+    args[:2] = args[1], args[0]
+    stream = _drop(args, 'stream-ref')
+    if not isa(stream, Pair):
+        raise IndexError('stream-ref index out of range')
+    return stream.car
+
+def _map(proc, streams, env):
+    """Make a stream of results of proc applied to members of streams."""
+    if not all(isa(i, Pair) for i in streams):
+        return []
+    first = apply_procedure(proc, [i.car for i in streams], env)
+    return Pair(first, _lazy(_map_rest, proc, streams, env))
+
+def _map_rest(proc, streams, env):
+    """Map proc over the rest of streams."""
+    return _map(proc, [force(i.cdr, env) for i in streams], env)
+
+def stream_map(proc, *args):
+    """Map procedure over streams lazily, stopping at the shortest one."""
+    env = args[-1]
+    streams = args[:-1]
+    require_type(is_procedure(proc), 'the first parameter of stream-map must be a procedure')
+    _require_streams(streams, 'stream-map')
+    return _map(proc, streams, env)
+
+def _filter(pred, stream, env):
+    """Make a stream of members of the stream satisfying pred."""
+    while isa(stream, Pair):
+        result = apply_procedure(pred, [stream.car], env)
+        if result or isa(result, list):
+            return Pair(stream.car, _lazy(_filter_rest, pred, stream, env))
+        stream = force(stream.cdr, env)
+    return []
+
+def _filter_rest(pred, stream, env):
+    """Filter the rest of the stream."""
+    return _filter(pred, force(stream.cdr, env), env)
+
+def stream_filter(pred, stream, env):
+    """Filter members of the stream by pred lazily."""
+    require_type(is_procedure(pred), 'the first parameter of stream-filter must be a procedure')
+    _require_stream(stream, 'stream-filter')
+    return _filter(pred, stream, env)
+
+def stream_for_each(args):
+    """Call procedure with members of streams until the shortest one ends."""
+    env = args.pop()
+    proc = args.pop(0)
+    streams = args[:]
+    args.clear()
+    require_type(is_procedure(proc), 'the first parameter of stream-for-each must be a procedure')
+    _require_streams(streams, 'stream-for-each')
+    while all(isa(i, Pair) for i in streams):
+        apply_procedure(proc, [i.car for i in streams], env)
+        streams = [force(i.cdr, env) for i in streams]
+    return None
+
+def stream_fold(args):
+    """Accumulate base by calling proc with it and every member of the stream."""
+    proc, base, stream, env = args
+    args.clear()
+    require_type(is_procedure(proc), 'the first parameter of stream-fold must be a procedure')
+    _require_stream(stream, 'stream-fold')
+    while isa(stream, Pair):
+        base = apply_procedure(proc, [base, stream.car], env)
+        stream = force(stream.cdr, env)
+    return base
+
+def _from(first, step):
+    """Make an infinite stream of numbers."""
+    return Pair(first, _lazy(_from, add(first, step), step))
+
+def stream_from(first, step=1):
+    """Make an infinite stream of numbers from first by step."""
+    require_type(is_number(first) and is_number(step), 'parameters of stream-from must be numbers')
+    return _from(first, step)
+
+def _range(first, past, step):
+    """Make a stream of numbers from first before past."""
+    if first < past if step > 0 else first > past:
+        return Pair(first, _lazy(_range, add(first, step), past, step))
+    return []
+
+def stream_range(first, past, step=None):
+    """Make a stream of numbers from first by step before past."""
+    require_type(is_rational(first) and is_rational(past) and (step is None or is_rational(step)),
+            'parameters of stream-range must be real numbers')
+    if step is None:
+        step = 1 if first < past else -1
+    require_type(step != 0, 'the step of stream-range must not be zero')
+    return _range(first, past, step)
+
+def _port_stream(port, reader, env):
+    """Make a stream of what the reader gets from the port until its end."""
+    if reader is None:
+        item = ports.read_line(port)
+    else:
+        item = apply_procedure(reader, [port], env)
+    if is_eof(item):
+        return []
+    return Pair(item, _lazy(_port_stream, port, reader, env))
+
+def port2stream(*args):
+    """Make a stream of lines of the port, or what reader gets from it, read lazily."""
+    env = args[-1]
+    port = args[0] if len(args) > 1 else None
+    reader = args[1] if len(args) > 2 else None
+    require_type(reader is None or is_procedure(reader),
+            'the reader of port->stream must be a procedure')
+    return _port_stream(port, reader, env)
+
+def define_primitives(env):
+    """Define primitives of streams in env."""
+    env.update({
+        'stream-nil':[], 'the-empty-stream':[], 'stream-null?':is_null,
+        'empty-stream?':is_null, 'stream-pair?':is_stream_pair, 'stream?':is_stream,
+        'stream-car':stream_car, 'stream-cdr':Primitive(stream_cdr, need_env=True),
+        'stream':lambda *x: list2stream(seq2list(x)), 'list->stream':list2stream,
+        'stream->list':Primitive(stream2list, (1, 2), need_env=True, own_args=True),
+        'stream-take':Primitive(stream_take, need_env=True),
+        'stream-drop':Primitive(stream_drop, (2, 2), need_env=True, own_args=True),
+        'stream-ref':Primitive(stream_ref, (2, 2), need_env=True, own_args=True),
+        'stream-map':Primitive(stream_map, (2, None), need_env=True),
+        'stream-filter':Primitive(stream_filter, need_env=True),
+        'stream-for-each':Primitive(stream_for_each, (2, None), need_env=True, own_args=True),
+        'stream-fold':Primitive(stream_fold, (3, 3), need_env=True, own_args=True),
+        'stream-from':stream_from, 'stream-range':stream_range,
+        'port->stream':Primitive(port2stream, (0, 2), need_env=True),
+    })
+    return env
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+"""Regression checks of characters compared as values."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheme_types import Char, is_eqv, is_equal
+import hashtable
+
+class CharTest(unittest.TestCase):
+    """Characters read apart are the same by eqv? and as keys of hash tables."""
+    def test_eqv(self):
+        """Compare characters by eqv?, apart from strings."""
+        self.assertTrue(is_eqv(Char('a'), Char('a')))
+        self.assertFalse(is_eqv(Char('a'), Char('b')))
+        self.assertFalse(is_eqv(Char('a'), 'a'))
+    def test_hash_keys(self):
+        """Find a value set by one character by another in eqv? and equal? tables."""
+        for equiv in (is_eqv, is_equal):
+            table = hashtable.HashTable(hashtable._KEYS[equiv])
+            hashtable.hash_table_set(table, Char('a'), 1)
+            self.assertEqual(hashtable.hash_table_ref_default(table, Char('a'), 'missing'), 1)
+            self.assertEqual(hashtable.hash_table_ref_default(table, 'a', 'missing'), 'missing')
+
+if __name__ == '__main__':
+    unittest.main()
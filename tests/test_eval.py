@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+"""Regression checks of eval defining names inside procedures."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scheme
+import vm
+
+def _run(text):
+    """Evaluate statements in text, returning the value of the last one."""
+    result = None
+    for line, parts in scheme._read_all(text):
+        result = scheme.evaluate(scheme.expand(parts))
+    return result
+
+class EvalDefineTest(unittest.TestCase):
+    """A name defined by eval in a procedure is found in the call, by both evaluators."""
+    def check(self, prefix):
+        """Define and refer to names in calls of procedures, named with prefix."""
+        self.assertEqual(_run("(define ({0}a) (eval '(define {0}x 3)) {0}x) ({0}a)".format(prefix)), 3)
+        self.assertEqual(_run("(define ({0}b n) (eval (list 'define '{0}y n))"
+                " ((lambda () {0}y))) ({0}b 7)".format(prefix)), 7)
+        # it's local to the call
+        self.assertNotIn(prefix+'x', scheme.global_env)
+    def test_analyzer(self):
+        """Evaluate by the analyzer."""
+        self.check('analyzed-')
+    def test_vm(self):
+        """Evaluate by bytecode."""
+        saved = scheme._compile
+        scheme._compile = vm.compile_code
+        try:
+            self.check('compiled-')
+        finally:
+            scheme._compile = saved
+
+if __name__ == '__main__':
+    unittest.main()
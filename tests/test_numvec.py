@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+"""Regression checks of members of numeric vectors."""
+
+import importlib.util
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scheme
+
+@unittest.skipIf(importlib.util.find_spec('numpy') is None, 'NumPy is not installed')
+class MemberTest(unittest.TestCase):
+    """Booleans aren't numbers to store in vectors, though python counts them as ints."""
+    def test_booleans(self):
+        """Refuse booleans as members and operands."""
+        env = scheme.global_env
+        for name, args in (('make-s64vector', [3, True]), ('make-f64vector', [3, False]),
+                ('s64vector', [1, True]), ('f64vector', [True])):
+            with self.assertRaises(TypeError):
+                env[name](*args)
+        with self.assertRaises(TypeError):
+            env['numvector-add'](env['f64vector'](1.0), True)
+    def test_numbers(self):
+        """Store integers and reals."""
+        self.assertEqual(str(scheme.global_env['make-s64vector'](2, 4)), '#s64(4 4)')
+        self.assertEqual(str(scheme.global_env['f64vector'](1, 2.5)), '#f64(1.0 2.5)')
+
+if __name__ == '__main__':
+    unittest.main()
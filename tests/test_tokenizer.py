@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+"""Regression checks of the tokenizer."""
+
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tokenizer import Tokenizer
+
+class UnterminatedTest(unittest.TestCase):
+    """Text that ends in an unterminated token is reported once, then the end of file."""
+    def _check(self, text, msg):
+        """Read tokens of text, expecting msg raised after them."""
+        tokenizer = Tokenizer(io.StringIO(text))
+        self.assertEqual([tokenizer.next_token() for _ in range(3)], ['(', 'a', ')'])
+        with self.assertRaisesRegex(SyntaxError, msg):
+            tokenizer.next_token()
+        self.assertIsNone(tokenizer.next_token())
+        self.assertIsNone(tokenizer.next_line())
+    def test_string(self):
+        """Check a string left open."""
+        self._check('(a)\n"abc', 'unterminated string')
+    def test_block_comment(self):
+        """Check a block comment left open."""
+        self._check('(a)\n#| abc\n(b)', 'unterminated block comment')
+
+if __name__ == '__main__':
+    unittest.main()
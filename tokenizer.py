@@ -1,48 +1,156 @@
 #!/usr/bin/env python3
 
+import re
+import sys
+
 class Tokenizer:
-    """Tokenizer to read tokens."""
-    import sys
+    """Tokenizer to read tokens.
+
+    Text is read into a buffer in chunks, or a line at a time from a terminal,
+    and scanned by moving a position over it, so the remaining text is never
+    copied for each token. Strings and block comments may span lines.
+    """
+    # whitespaces and line comments
+    _skip = re.compile(r"""(?:\s+|;[^\n]*)*""")
+    _blank = re.compile(r"""\s*\Z""")
+    _block_comment = re.compile(r"""#\||\|#""")
+    _chunk_size = 1 << 16
     def __init__(self, file=sys.stdin):
         """Bind a file stream to read."""
-        import re
         self._file = file
-        self._line = ''
-        self._regex = re.compile(self._generate_pattern())
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        try:
+            self._interactive = file.isatty()
+        except Exception:
+            self._interactive = False
+        # number of lines before the buffer and offset where current line starts
+        self._line_no = 1
+        self._line_start = 0
+        self._regex = re.compile('|'.join(self._yield_patterns()))
+        # position of the last token
+        self.line = self.column = 0
     def _yield_patterns(self):
         """Yield patterns of regular expressions."""
-        # comment
-        yield r""";.*"""
         # string
         yield r'"(?:\\.|[^\\"])*"'
         # unquote splicing
         yield r""",@"""
+        # character, which may be a delimiter
+        yield r"""#\\.[^\s('"`,;)]*"""
+        # vector
+        yield r"""#\("""
         # special
         yield r"""[('`,)]"""
         # normal
-        yield r"""[^\s('"`,;)]*"""
-    def _generate_pattern(self):
-        """Generate pattern for scheme."""
-        result = []
-        # space
-        result.append(r"""\s*""")
-        result.append('(')
-        result.append('|'.join(self._yield_patterns()))
-        result.append(')')
-        # remaining
-        result.append(r"""(.*)""")
-        return ''.join(result)
+        yield r"""[^\s('"`,;)]+"""
+    def _fill(self):
+        """Read more text into the buffer, return False at the end of file."""
+        if self._eof:
+            return False
+        if self._interactive:
+            text = self._file.readline()
+        else:
+            text = self._file.read(self._chunk_size)
+        if not text:
+            self._eof = True
+            return False
+        # drop text scanned
+        self._buf = self._buf[self._pos:] + text
+        self._line_start -= self._pos
+        self._pos = 0
+        return True
+    def _advance(self, end):
+        """Move position to end, counting lines passed."""
+        lines = self._buf.count('\n', self._pos, end)
+        if lines:
+            self._line_no += lines
+            self._line_start = self._buf.rfind('\n', self._pos, end) + 1
+        self._pos = end
+    def _skip_block_comment(self):
+        """Skip a nested block comment, return False if it isn't complete yet."""
+        depth = 0
+        for match in self._block_comment.finditer(self._buf, self._pos):
+            depth += 1 if match.group() == '#|' else -1
+            if depth == 0:
+                self._advance(match.end())
+                return True
+        return False
+    def error(self, msg):
+        """Return SyntaxError with the current position."""
+        return SyntaxError('{0} at line {1}, column {2}'.format(
+            msg, self._line_no, self._pos-self._line_start+1))
+    def _error_at_end(self, msg):
+        """Return SyntaxError with the current position, dropping text that can't be read.
+
+        Readers go on after an error, so they mustn't meet the same text again.
+        """
+        error = self.error(msg)
+        self._advance(len(self._buf))
+        return error
+    def _skip_blank(self):
+        """Skip whitespaces and comments, return False at the end of file."""
+        while True:
+            end = self._skip.match(self._buf, self._pos).end()
+            if end == len(self._buf):
+                # the last comment may continue in text not read yet, but
+                # comments never contain a newline
+                self._advance(max(self._buf.rfind('\n', self._pos, end)+1, self._pos))
+                if not self._fill():
+                    return False
+                continue
+            self._advance(end)
+            if self._buf.startswith('#|', self._pos):
+                if not self._skip_block_comment():
+                    if not self._fill():
+                        raise self._error_at_end('unterminated block comment')
+                continue
+            return True
+    def next_line(self):
+        """Get the line where the next token starts, or None at the end of file."""
+        return self._line_no if self._skip_blank() else None
     def next_token(self):
         """Get the next token."""
         while True:
-            if self._line == '':
-                self._line = self._file.readline()
-            if self._line == '':
+            if not self._skip_blank():
+                return None
+            match = self._regex.match(self._buf, self._pos)
+            if match is None:
+                # only a string can't be matched before its end is read
+                if not self._fill():
+                    raise self._error_at_end('unterminated string')
+                continue
+            if match.end() == len(self._buf) and not self._eof and self._fill():
+                # the token may continue in text not read yet
+                continue
+            self.line = self._line_no
+            self.column = self._pos - self._line_start + 1
+            self._advance(match.end())
+            return match.group()
+    def peek_char(self):
+        """Get the next character without reading it, or None at the end of file."""
+        if self._pos == len(self._buf) and not self._fill():
+            return None
+        return self._buf[self._pos]
+    def read_char(self):
+        """Read the next character, or return None at the end of file."""
+        char = self.peek_char()
+        if char is not None:
+            self._advance(self._pos+1)
+        return char
+    def read_line(self):
+        """Read the rest of the line without its newline, or return None at the end of file."""
+        end = self._buf.find('\n', self._pos)
+        while end < 0 and self._fill():
+            end = self._buf.find('\n', self._pos)
+        if end < 0:
+            if self._pos == len(self._buf):
                 return None
-            token, self._line = self._regex.match(self._line).groups()
-            if token != '':
-                return token
+            end = len(self._buf)
+        line = self._buf[self._pos:end]
+        self._advance(min(end+1, len(self._buf)))
+        return line
     def empty(self):
         """Judge whether there are more than one expressions in a line."""
-        return self._line == '' or self._line.isspace()
-
+        return self._blank.match(self._buf, self._pos) is not None
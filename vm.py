@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+
+"""Compiler from expanded forms to bytecode and the virtual machine to run it."""
+
+import scheme_types
+from scheme_types import *
+
+# every instruction is an opcode followed by one operand in Code.ops
+_opnames = ('LREF0', 'LREF1', 'LREF', 'LREF_CHECK', 'GREF', 'CONST', 'CALL', 'TCALL',
+        'JUMPF', 'JUMPT', 'JUMPT_KEEP', 'JUMP', 'RETURN', 'POP', 'CLOSURE', 'LSET',
+        'GSET', 'LDEF', 'GDEF', 'DELAY', 'FORCE', 'CASE', 'ENTER', 'STEP', 'LEAVE')
+(LREF0, LREF1, LREF, LREF_CHECK, GREF, CONST, CALL, TCALL,
+        JUMPF, JUMPT, JUMPT_KEEP, JUMP, RETURN, POP, CLOSURE, LSET,
+        GSET, LDEF, GDEF, DELAY, FORCE, CASE, ENTER, STEP, LEAVE) = range(len(_opnames))
+
+class Code:
+    """Compiled instructions of a lambda body or a top-level form."""
+    __slots__ = ('ops', 'scope', 'genv', 'name')
+    def __init__(self, scope, genv, name=None):
+        """Construct empty code running in frames of scope."""
+        self.ops = []
+        self.scope = scope
+        self.genv = genv
+        self.name = name
+    def emit(self, op, arg=None):
+        """Append an instruction and return the position of its operand."""
+        self.ops.append(op)
+        self.ops.append(arg)
+        return len(self.ops) - 1
+    def label(self):
+        """Return the position of the next instruction."""
+        return len(self.ops)
+    def patch(self, pos):
+        """Make the jump whose operand is at pos go to the next instruction."""
+        self.ops[pos] = len(self.ops)
+    def __call__(self, env):
+        """Run the code in env."""
+        return run(self, env)
+
+def compile_code(parts, scope):
+    """Compile expanded parts to code run in an environment of scope."""
+    code = Code(scope, root_env(scope))
+    _compile(parts, code, scope, True)
+    code.emit(RETURN)
+    return code
+
+def _compile(parts, code, scope, tail):
+    """Emit instructions of parts, returning in place if they're in tail position."""
+    if isa(parts, Symbol):
+        return _compile_ref(parts, code, scope)
+    if not isa(parts, list) or not parts:
+        return code.emit(CONST, parts)
+    if isa(parts[0], str) and parts[0] in _compilers:
+        return _compilers[parts[0]](parts, code, scope, tail)
+    for i in parts:
+        _compile(i, code, scope, False)
+    code.emit(TCALL if tail else CALL, len(parts)-1)
+
+def _compile_ref(symbol, code, scope):
+    """Emit reference of a variable."""
+    location = resolve(symbol, scope)
+    if location is None:
+        return code.emit(GREF, symbol)
+    depth, i = location
+    if i >= frame_at(scope, depth).nparms:
+        # defined inside a body, may be referred before its definition
+        return code.emit(LREF_CHECK, (depth, i, symbol))
+    if depth == 0:
+        return code.emit(LREF0, i)
+    if depth == 1:
+        return code.emit(LREF1, i)
+    code.emit(LREF, (depth, i))
+
+def _compile_sequence(exprs, code, scope, tail):
+    """Emit expressions evaluated in order, leaving the last value."""
+    for i in exprs[:-1]:
+        _compile(i, code, scope, False)
+        code.emit(POP)
+    _compile(exprs[-1], code, scope, tail)
+
+def _end_branch(code, tail, ends):
+    """Finish a branch by returning or jumping to the end of the form."""
+    if tail:
+        code.emit(RETURN)
+    else:
+        ends.append(code.emit(JUMP))
+
+def _compile_quote(parts, code, scope, tail):
+    """Emit (quote datum)."""
+    code.emit(CONST, do_quote(parts[1]))
+
+def _compile_define(parts, code, scope, tail):
+    """Emit (define symbol value)."""
+    _, symbol, val = parts
+    if not isa(scope, Scope):
+        _compile_value(symbol, val, code, scope)
+        return code.emit(GDEF, symbol)
+    # names defined by eval in a frame haven't been scanned
+    i = scope.add(symbol)
+    _compile_value(symbol, val, code, scope)
+    code.emit(LDEF, (i, symbol))
+
+def _compile_value(symbol, val, code, scope):
+    """Emit value of a definition, naming the code of a lambda after symbol."""
+    if isa(val, list) and val and val[0] == 'lambda':
+        return _compile_lambda(val, code, scope, False, symbol)
+    _compile(val, code, scope, False)
+
+def _compile_lambda(parts, code, scope, tail, name=None):
+    """Emit (lambda parms body)."""
+    new_scope = Scope(parts[1], scan_defines(parts[2]), scope, parts[2], name)
+    body = Code(new_scope, code.genv, name)
+    _compile(parts[2], body, new_scope, True)
+    body.emit(RETURN)
+    code.emit(CLOSURE, body)
+
+def _compile_set(parts, code, scope, tail):
+    """Emit (set! symbol value) which leaves the old value."""
+    _, symbol, val = parts
+    _compile_ref(symbol, code, scope)
+    _compile(val, code, scope, False)
+    location = resolve(symbol, scope)
+    code.emit(GSET, symbol) if location is None else code.emit(LSET, location)
+
+def _compile_delay(parts, code, scope, tail):
+    """Emit (delay expr) whose expr has been wrapped by a lambda."""
+    _compile(parts[1], code, scope, False)
+    code.emit(DELAY)
+
+def _compile_force(parts, code, scope, tail):
+    """Emit (force promise)."""
+    _compile(parts[1], code, scope, False)
+    code.emit(FORCE)
+
+def _compile_case(parts, code, scope, tail):
+    """Emit (case key clauses...) whose last clause is else."""
+    _compile(parts[1], code, scope, False)
+    tests = []
+    for clause in parts[2:-1]:
+        # datums are quoted by _expand
+        tests.append(code.emit(CASE, [do_quote(clause[0][1]), None]))
+    code.emit(POP)
+    ends = []
+    _compile_sequence(parts[-1][1:], code, scope, tail)
+    _end_branch(code, tail, ends)
+    for test, clause in zip(tests, parts[2:-1]):
+        code.ops[test][1] = code.label()
+        _compile_sequence(clause[1:], code, scope, tail)
+        _end_branch(code, tail, ends)
+    for i in ends:
+        code.patch(i)
+
+def _compile_cond(parts, code, scope, tail):
+    """Emit (cond clauses...) whose last clause is else."""
+    ends = []
+    for clause in parts[1:-1]:
+        _compile(clause[0], code, scope, False)
+        if not clause[1:]:
+            ends.append(code.emit(JUMPT_KEEP))
+            continue
+        test = code.emit(JUMPF)
+        _compile_sequence(clause[1:], code, scope, tail)
+        _end_branch(code, tail, ends)
+        code.patch(test)
+    _compile_sequence(parts[-1][1:], code, scope, tail)
+    for i in ends:
+        code.patch(i)
+
+def _compile_do(parts, code, scope, tail):
+    """Emit do form expanded into (do parms inits steps cond ret_val bodies)."""
+    _, parms, inits, steps, cond, ret_val, bodies = parts
+    for i in inits:
+        _compile(i, code, scope, False)
+    do_scope = Scope(list(parms), scan_defines(bodies), scope)
+    code.emit(ENTER, do_scope)
+    loop = code.label()
+    _compile(cond, code, do_scope, False)
+    done = code.emit(JUMPT)
+    for i in bodies:
+        _compile(i, code, do_scope, False)
+        code.emit(POP)
+    for i in steps:
+        _compile(i, code, do_scope, False)
+    code.emit(STEP, len(parms))
+    code.emit(JUMP, loop)
+    code.patch(done)
+    _compile(ret_val, code, do_scope, tail)
+    if not tail:
+        code.emit(LEAVE)
+
+def _compile_begin(parts, code, scope, tail):
+    """Emit (begin exprs...)."""
+    _compile_sequence(parts[1:], code, scope, tail)
+
+_compilers = {
+        'quote': _compile_quote, 'define': _compile_define, 'lambda': _compile_lambda,
+        'set!': _compile_set, 'delay': _compile_delay, 'force': _compile_force,
+        'case': _compile_case, 'cond': _compile_cond, 'do': _compile_do,
+        'begin': _compile_begin,
+}
+
+def _call(func, args, env):
+    """Call func from code, returning its value."""
+    if type(func) is Primitive:
+        if len(args) == 2 and func.fast2 is not None:
+            return func.fast2(args[0], args[1])
+        if len(args) == 1 and func.fast1 is not None:
+            return func.fast1(args[0])
+    return apply_procedure(func, args, env)
+
+def _leave_tail_call(func, args, env):
+    """Leave a tail call to the caller of code, which must be apply_procedure."""
+    if isa(func, Procedure):
+        return TailCall(func, args)
+    return _call(func, args, env)
+
+# replaced to make procedures called through apply_procedure when profiling
+_inline_code = Code
+_tail_call = _call
+# apply of the global environment, whose calls are run as calls of the
+# procedure applied, so that they don't recurse in python either
+apply_primitive = None
+
+def run(code, env):
+    """Run code in env and return its value.
+
+    Calls of procedures compiled to bytecode don't recurse in python. The
+    caller's code, position, environment and operand stack are saved in
+    frames, so the depth of recursion is only limited by memory. A tail call
+    is always followed by RETURN, so others may leave the value as a call.
+    Calls run here and iterations of do loops call the step hook of
+    limited evaluations, which is installed before they start.
+    """
+    step_hook = scheme_types.step_hook
+    ops = code.ops
+    genv = code.genv
+    stack = []
+    frames = []
+    pc = 0
+    while True:
+        op = ops[pc]
+        arg = ops[pc+1]
+        pc += 2
+        if op == LREF0:
+            stack.append(env.vars[arg])
+        elif op == LREF1:
+            stack.append(env.outer.vars[arg])
+        elif op == GREF:
+            try:
+                stack.append(genv[arg])
+            except KeyError:
+                stack.append(lookup_unresolved(env, arg, genv))
+        elif op == CONST:
+            stack.append(arg)
+        elif op == CALL or op == TCALL:
+            if arg == 2:
+                func = stack[-3]
+                if type(func) is Primitive and func.fast2 is not None:
+                    # values are only kept on the stack, so that a stream
+                    # consumed by a callee can be freed
+                    stack[-3:] = (func.fast2(stack[-2], stack[-1]),)
+                    continue
+            args = stack[len(stack)-arg:]
+            del stack[len(stack)-arg:]
+            func = stack.pop()
+            while func is apply_primitive:
+                func, args = spread_args(args)
+                arg = len(args)
+            if type(func) is Procedure and type(func.body) is _inline_code:
+                if step_hook is not None:
+                    step_hook()
+                scope = func.scope
+                if scope.arity != arg:
+                    args = func.collect_args(args)
+                if scope.padding:
+                    args.extend(scope.padding)
+                if op == TCALL:
+                    code = func.body
+                    ops = code.ops
+                    genv = code.genv
+                    env = Frame(args, func.env, scope)
+                    pc = 0
+                else:
+                    frames.append((code, pc, env, stack))
+                    code = func.body
+                    ops = code.ops
+                    genv = code.genv
+                    env = Frame(args, func.env, scope)
+                    stack = []
+                    pc = 0
+            elif op == TCALL and not frames:
+                return _tail_call(func, args, env)
+            else:
+                stack.append(_call(func, args, env))
+        elif op == JUMPF:
+            value = stack.pop()
+            if not value and not isa(value, list):
+                pc = arg
+        elif op == RETURN:
+            if not frames:
+                return stack.pop()
+            code, pc, env, caller = frames.pop()
+            caller.append(stack.pop())
+            stack = caller
+            ops = code.ops
+            genv = code.genv
+        elif op == JUMP:
+            pc = arg
+        elif op == LREF:
+            stack.append(frame_at(env, arg[0]).vars[arg[1]])
+        elif op == LREF_CHECK:
+            value = frame_at(env, arg[0]).vars[arg[1]]
+            if value is UNASSIGNED:
+                raise LookupError('unbound '+arg[2])
+            stack.append(value)
+        elif op == POP:
+            stack.pop()
+        elif op == JUMPT:
+            # as do tests its condition
+            if stack.pop():
+                pc = arg
+        elif op == JUMPT_KEEP:
+            value = stack[-1]
+            if value or isa(value, list):
+                pc = arg
+            else:
+                stack.pop()
+        elif op == CLOSURE:
+            stack.append(Procedure(arg.scope, arg, env))
+        elif op == LSET:
+            frame_at(env, arg[0]).vars[arg[1]] = stack.pop()
+        elif op == GSET:
+            value = stack.pop()
+            env.find(arg)[arg] = value
+        elif op == LDEF:
+            i, symbol = arg
+            if i >= len(env.vars):
+                env.vars.extend([UNASSIGNED] * (i+1-len(env.vars)))
+            env.vars[i] = stack.pop()
+            stack.append(symbol)
+        elif op == GDEF:
+            genv[arg] = stack.pop()
+            stack.append(arg)
+        elif op == DELAY:
+            stack.append(Promise(stack.pop()))
+        elif op == FORCE:
+            promise = stack[-1]
+            if type(promise) is Promise and promise.forced:
+                stack[-1] = promise.value
+            else:
+                stack[-1] = force(promise, genv)
+        elif op == CASE:
+            if stack[-1] in arg[0]:
+                stack.pop()
+                pc = arg[1]
+        elif op == ENTER:
+            n = arg.nparms
+            values = stack[len(stack)-n:]
+            del stack[len(stack)-n:]
+            env = Frame(values + arg.padding, env, arg)
+        elif op == STEP:
+            if step_hook is not None:
+                step_hook()
+            env.vars[:arg] = stack[len(stack)-arg:]
+            del stack[len(stack)-arg:]
+        elif op == LEAVE:
+            env = env.outer
+        else:
+            raise RuntimeError('unknown opcode {0}'.format(op))
+
+def _format_arg(op, arg):
+    """Format operand of an instruction."""
+    if op == CONST:
+        return tostr(arg)
+    if op == CLOSURE:
+        return '<code {0}>'.format(arg.name or 'lambda')
+    if op == CASE:
+        return '{0} -> {1}'.format(tostr(arg[0]), arg[1])
+    if op in (ENTER,):
+        return tostr(arg.parms)
+    if op in (LREF_CHECK, LDEF):
+        return '{0} ; {1}'.format(arg[:2] if op == LREF_CHECK else arg[0], arg[-1])
+    return '' if arg is None else str(arg)
+
+def disassemble(proc):
+    """Print instructions of a procedure compiled to bytecode."""
+    require_type(isa(proc, Procedure) and isa(proc.body, Code),
+            'the parameter of disassemble must be a procedure compiled to bytecode')
+    pending = [proc.body]
+    while pending:
+        code = pending.pop(0)
+        print('{0} {1}:'.format(code.name or 'lambda', tostr(code.scope.parms)))
+        for pc in range(0, len(code.ops), 2):
+            op, arg = code.ops[pc], code.ops[pc+1]
+            print('{0:>6}  {1:<11} {2}'.format(pc, _opnames[op], _format_arg(op, arg)).rstrip())
+            if op == CLOSURE:
+                pending.append(arg)